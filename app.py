@@ -1,8 +1,9 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from app.controllers.telegram_controller import telegram_router, setup_telegram_bot
+from app.controllers.telegram_controller import telegram_router, setup_telegram_bot, shutdown_telegram_bot
 from app.controllers.logger_controller import logger
+from app.utils.task_supervisor import TaskSupervisor
 import os
 
 # Inicializar FastAPI
@@ -30,6 +31,11 @@ app.include_router(telegram_router)
 async def shutdown_event():
     """shut"""
     logger.info("Shutting down...")
+    # Primero las tareas en segundo plano (escrituras de memoria), después los buffers del bot
+    supervisor = TaskSupervisor.get_instance()
+    drained = await supervisor.drain()
+    logger.info(f"Background tasks drained (clean={drained}): {supervisor.stats()}")
+    await shutdown_telegram_bot()
 
 
 @app.on_event("startup")
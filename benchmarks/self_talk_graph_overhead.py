@@ -0,0 +1,66 @@
+"""
+Micro-benchmark del overhead por mensaje de SintergiaSelfTalkGraph.
+
+Compara construir y compilar el grafo en cada mensaje (comportamiento anterior)
+con invocar el grafo compilado una sola vez en el constructor. Los LLMs son
+modelos fake de langchain, así que solo se mide el coste del grafo.
+
+    PYTHONPATH=<raíz que resuelve `app`> python benchmarks/self_talk_graph_overhead.py [iteraciones]
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+
+os.environ.setdefault("RESPONSE_CACHE_ENABLED", "false")
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from app.controllers.logger_controller import logger
+from app.controllers.sintergia_controller import SintergiaSelfTalkGraph
+
+logger.setLevel(logging.WARNING)
+
+
+class FakeLLMManager:
+    def __init__(self):
+        self.model = FakeListChatModel(responses=["the lattice hums with shared thought"])
+
+    def get_instance(self, **kwargs):
+        return self.model
+
+
+class FakeMemoryManager:
+    async def add_to_memory(self, entry):
+        return True
+
+    async def embed_text(self, text, input_type="passage"):
+        return None
+
+
+async def run(iterations: int):
+    dialogue = SintergiaSelfTalkGraph(FakeLLMManager(), FakeMemoryManager())
+    context = {"mode": "autonomous"}
+
+    async def per_message_compile():
+        graph = dialogue._build_graph(parallel=False)
+        await graph.ainvoke(dialogue.new_state("benchmark", context))
+
+    async def compiled_once():
+        await dialogue.sequential_graph.ainvoke(dialogue.new_state("benchmark", context))
+
+    results = {}
+    for name, step in (("compile per message", per_message_compile), ("compiled once", compiled_once)):
+        await step()  # calentamiento
+        started = time.perf_counter()
+        for _ in range(iterations):
+            await step()
+        results[name] = (time.perf_counter() - started) / iterations * 1000
+        print(f"{name:>20}: {results[name]:.3f} ms/message")
+
+    before, after = results["compile per message"], results["compiled once"]
+    print(f"{'saved':>20}: {before - after:.3f} ms/message ({before / after:.1f}x)")
+
+
+if __name__ == "__main__":
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
@@ -0,0 +1,171 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from collections import OrderedDict
+import math
+import os
+from app.controllers.logger_controller import logger
+from app.models.singleton_model import LLMProvider
+
+# Caracteres por token para la aproximación local (sin tokenizer del proveedor)
+_CHARS_PER_TOKEN = {
+    LLMProvider.OPENAI: 4.0,
+    LLMProvider.ANTHROPIC: 3.5,
+    LLMProvider.GROQ: 3.6,
+}
+_DEFAULT_CHARS_PER_TOKEN = 3.5  # el más conservador, p.ej. para el router
+
+# Tokens que añade cada mensaje del chat (rol, separadores)
+_MESSAGE_OVERHEAD = 4
+
+
+class TokenCounter:
+    """
+    Cuenta tokens por proveedor: tiktoken para OpenAI si está instalado y una
+    aproximación por caracteres para el resto. Los conteos se cachean (LRU)
+    por (tokenizer, texto).
+    """
+
+    def __init__(self, cache_size: int = 4096):
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[str, int, int], int]" = OrderedDict()
+        self._encoding = None
+        self._encoding_unavailable = False
+        self.hits = 0
+        self.misses = 0
+
+    def _tiktoken(self):
+        if self._encoding is None and not self._encoding_unavailable:
+            try:
+                import tiktoken
+                self._encoding = tiktoken.get_encoding(os.getenv("TIKTOKEN_ENCODING", "o200k_base"))
+            except Exception as e:
+                logger.warning(f"tiktoken unavailable, using approximate token counts: {str(e)}")
+                self._encoding_unavailable = True
+        return self._encoding
+
+    def count(self, text: str, provider: Optional[LLMProvider] = None) -> int:
+        encoding = self._tiktoken() if provider == LLMProvider.OPENAI else None
+        tokenizer = "tiktoken" if encoding is not None else getattr(provider, "value", "approx")
+        key = (tokenizer, len(text), hash(text))
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return cached
+
+        self.misses += 1
+        if encoding is not None:
+            tokens = len(encoding.encode(text, disallowed_special=()))
+        else:
+            tokens = math.ceil(len(text) / _CHARS_PER_TOKEN.get(provider, _DEFAULT_CHARS_PER_TOKEN))
+        self._cache[key] = tokens
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return tokens
+
+    def stats(self) -> Dict[str, int]:
+        return {"cached": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+
+class AssembledContext:
+    """Turnos y memorias seleccionados (en su orden original) y los tokens usados"""
+    __slots__ = ("turns", "memories", "tokens", "budget", "dropped_turns", "dropped_memories")
+
+    def __init__(self, turns: List[Any], memories: List[str], tokens: int, budget: int,
+                 dropped_turns: int, dropped_memories: int):
+        self.turns = turns
+        self.memories = memories
+        self.tokens = tokens
+        self.budget = budget
+        self.dropped_turns = dropped_turns
+        self.dropped_memories = dropped_memories
+
+
+class ContextAssembler:
+    """
+    Empaqueta system prompt + turnos recientes + memorias recuperadas dentro de
+    un presupuesto de tokens. El system prompt y los últimos `keep_last` turnos
+    siempre entran; el resto se elige de mayor a menor puntuación (recencia
+    para los turnos, relevancia para las memorias) mientras quepa.
+    """
+    _instance = None
+
+    def __init__(self,
+                 budget: int = 1500,
+                 recency_decay: float = 0.8,
+                 memory_weight: float = 0.7,
+                 counter: Optional[TokenCounter] = None):
+        if budget <= 0:
+            raise ValueError("budget must be positive")
+        self.budget = budget
+        self.recency_decay = recency_decay
+        self.memory_weight = memory_weight
+        self.counter = counter or TokenCounter()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls(
+                budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", 1500)),
+                recency_decay=float(os.getenv("CONTEXT_RECENCY_DECAY", 0.8)),
+                memory_weight=float(os.getenv("CONTEXT_MEMORY_WEIGHT", 0.7))
+            )
+        return cls._instance
+
+    @staticmethod
+    def _text(item: Any) -> str:
+        if isinstance(item, str):
+            return item
+        if isinstance(item, dict):
+            return str(item.get("content", ""))
+        return str(getattr(item, "content", item))
+
+    def count_tokens(self, item: Any, provider: Optional[LLMProvider] = None) -> int:
+        """Tokens de un texto o mensaje, incluido el overhead por mensaje"""
+        return self.counter.count(self._text(item), provider) + _MESSAGE_OVERHEAD
+
+    def assemble(self,
+                 system_prompt: str,
+                 turns: Sequence[Any],
+                 memories: Sequence[Tuple[str, float]] = (),
+                 provider: Optional[LLMProvider] = None,
+                 budget: Optional[int] = None,
+                 keep_last: int = 1) -> AssembledContext:
+        """
+        `turns` (mensajes langchain, dicts role/content o textos) van del más
+        antiguo al más reciente; `memories` son pares (texto, relevancia 0-1).
+        """
+        budget = self.budget if budget is None else budget
+        used = self.count_tokens(system_prompt, provider)
+
+        keep_last = min(keep_last, len(turns))
+        required = range(len(turns) - keep_last, len(turns))
+        for index in required:
+            used += self.count_tokens(turns[index], provider)
+        if used > budget:
+            logger.warning(f"Required prompt context ({used} tokens) exceeds the budget of {budget}")
+
+        # (puntuación, tipo, índice, tokens) de todo lo opcional
+        candidates = []
+        newest = len(turns) - 1
+        for index in range(len(turns) - keep_last):
+            score = self.recency_decay ** (newest - index)
+            candidates.append((score, 0, index, self.count_tokens(turns[index], provider)))
+        for index, (text, relevance) in enumerate(memories):
+            score = self.memory_weight * min(max(float(relevance or 0.0), 0.0), 1.0)
+            candidates.append((score, 1, index, self.count_tokens(text, provider)))
+
+        selected_turns, selected_memories = set(required), set()
+        for score, kind, index, tokens in sorted(candidates, key=lambda c: (-c[0], c[1], -c[2])):
+            if used + tokens > budget:
+                continue
+            used += tokens
+            (selected_turns if kind == 0 else selected_memories).add(index)
+
+        return AssembledContext(
+            turns=[turn for index, turn in enumerate(turns) if index in selected_turns],
+            memories=[text for index, (text, _) in enumerate(memories) if index in selected_memories],
+            tokens=used,
+            budget=budget,
+            dropped_turns=len(turns) - len(selected_turns),
+            dropped_memories=len(memories) - len(selected_memories)
+        )
@@ -0,0 +1,150 @@
+from typing import Any, Dict, List, Optional
+from collections import deque
+from datetime import datetime
+import os
+from langchain_core.messages import HumanMessage, SystemMessage
+from app.controllers.logger_controller import logger
+from app.models.Memorymanager import MemoryEntry
+from app.utils.task_supervisor import TaskSupervisor
+
+_SEGMENT_PROMPT = (
+    "you compress group chat logs into a memory note. keep who said what about which topics, "
+    "open questions, recurring jokes and the overall mood. plain text, lowercase, "
+    "at most {words} words, no preamble."
+)
+_MERGE_PROMPT = (
+    "you merge older memory notes of a group chat into a single note. keep the long-range "
+    "topics and relationships, drop details that later notes make irrelevant. plain text, "
+    "lowercase, at most {words} words, no preamble."
+)
+
+
+class ConversationSummarizer:
+    """
+    Memoria jerárquica de la conversación del grupo:
+
+        recientes   últimos `raw_window` mensajes tal cual
+        resúmenes   cada `compact_after` mensajes el modelo rápido resume el
+                    bloque en segundo plano; con más de `max_summaries` notas,
+                    las dos más antiguas se fusionan en una
+        largo plazo cada resumen se guarda además en el vector store
+
+    Los prompts combinan `notes()` con `recent_lines()`, los mensajes que aún
+    no recoge ninguna nota, en lugar del historial crudo completo.
+    """
+
+    def __init__(self,
+                 llm: Any,
+                 memory_manager: Any = None,
+                 supervisor: Optional[TaskSupervisor] = None,
+                 raw_window: int = 50,
+                 compact_after: int = 20,
+                 max_summaries: int = 4,
+                 summary_words: int = 120,
+                 source: str = "conversation_summary"):
+        if compact_after < 1:
+            raise ValueError("compact_after must be at least 1")
+        self.llm = llm
+        self.memory_manager = memory_manager
+        self.supervisor = supervisor or TaskSupervisor.get_instance()
+        self.compact_after = compact_after
+        self.max_summaries = max_summaries
+        self.summary_words = summary_words
+        self.source = source
+
+        self.recent = deque(maxlen=raw_window)
+        self.summaries: List[str] = []
+        # Mensajes aún sin resumir; acotado por si el modelo falla de forma continuada
+        self._pending: List[str] = []
+        self._max_pending = compact_after * 4
+        self._compacting = False
+        self.compactions = 0
+        self.merges = 0
+        self.failures = 0
+
+    @classmethod
+    def from_env(cls, llm: Any, memory_manager: Any = None) -> "ConversationSummarizer":
+        return cls(
+            llm,
+            memory_manager=memory_manager,
+            compact_after=int(os.getenv("SUMMARY_COMPACT_AFTER", 20)),
+            max_summaries=int(os.getenv("SUMMARY_MAX_NOTES", 4)),
+            summary_words=int(os.getenv("SUMMARY_MAX_WORDS", 120))
+        )
+
+    async def add_message(self, line: str):
+        """Registra un mensaje ("usuario: texto") y lanza la compactación si toca"""
+        self.recent.append(line)
+        self._pending.append(line)
+        if len(self._pending) > self._max_pending and not self._compacting:
+            del self._pending[:len(self._pending) - self._max_pending]
+        if len(self._pending) >= self.compact_after and not self._compacting:
+            self._compacting = True
+            try:
+                await self.supervisor.submit(self.compact(), name="conversation_compaction")
+            except BaseException:
+                self._compacting = False
+                raise
+
+    async def _summarize(self, prompt: str, content: str) -> str:
+        response = await self.llm.ainvoke([
+            SystemMessage(content=prompt.format(words=self.summary_words)),
+            HumanMessage(content=content)
+        ])
+        return response.content.strip()
+
+    async def compact(self):
+        """Resume los bloques pendientes y fusiona las notas más antiguas"""
+        self._compacting = True
+        try:
+            while len(self._pending) >= self.compact_after:
+                batch = self._pending[:self.compact_after]
+                note = await self._summarize(_SEGMENT_PROMPT, "\n".join(batch))
+                # Solo se descartan los mensajes una vez resumidos
+                del self._pending[:len(batch)]
+                self.summaries.append(note)
+                self.compactions += 1
+                await self._store(note, len(batch))
+
+                while len(self.summaries) > self.max_summaries:
+                    merged = await self._summarize(_MERGE_PROMPT, "\n\n".join(self.summaries[:2]))
+                    self.summaries[:2] = [merged]
+                    self.merges += 1
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Failed to compact conversation history: {str(e)}")
+        finally:
+            self._compacting = False
+
+    async def _store(self, note: str, message_count: int):
+        """Guarda la nota en la memoria a largo plazo (vector store)"""
+        if self.memory_manager is None:
+            return
+        try:
+            await self.memory_manager.add_to_memory(MemoryEntry(
+                text=note,
+                source=self.source,
+                metadata={"type": "summary", "message_count": message_count},
+                timestamp=datetime.now()
+            ))
+        except Exception as e:
+            logger.error(f"Failed to store conversation summary: {str(e)}")
+
+    def notes(self) -> List[str]:
+        """Notas de la conversación, de la más antigua a la más reciente"""
+        return list(self.summaries)
+
+    def recent_lines(self) -> List[str]:
+        """Mensajes recientes que todavía no están resumidos, en orden"""
+        count = min(len(self._pending), len(self.recent))
+        return list(self.recent)[len(self.recent) - count:]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "recent": len(self.recent),
+            "pending": len(self._pending),
+            "summaries": len(self.summaries),
+            "compactions": self.compactions,
+            "merges": self.merges,
+            "failures": self.failures,
+        }
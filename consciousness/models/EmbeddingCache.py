@@ -1,54 +1,230 @@
-from typing import Dict, Optional
+from typing import Any, Dict, Optional, Tuple
+from collections import OrderedDict
+from datetime import timedelta
 import hashlib
-from datetime import datetime, timedelta
-import json
+import os
+import threading
+import time
+import numpy as np
+from app.controllers.logger_controller import logger
+from app.models.PersistentEmbeddingStore import PersistentEmbeddingStore
+
+class _EmbeddingSlab:
+    """Matriz float32 preasignada para embeddings de una misma dimensión"""
+
+    def __init__(self, dimension: int, capacity: int):
+        self.dimension = dimension
+        self.vectors = np.empty((capacity, dimension), dtype=np.float32)
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self._free = list(range(capacity - 1, -1, -1))
+
+    @property
+    def capacity(self) -> int:
+        return self.vectors.shape[0]
+
+    @property
+    def is_empty(self) -> bool:
+        return len(self._free) == self.capacity
+
+    def grow(self, capacity: int):
+        """Amplía la matriz conservando los slots existentes"""
+        old_capacity = self.capacity
+        if capacity <= old_capacity:
+            return
+        vectors = np.empty((capacity, self.dimension), dtype=np.float32)
+        vectors[:old_capacity] = self.vectors
+        timestamps = np.zeros(capacity, dtype=np.float64)
+        timestamps[:old_capacity] = self.timestamps
+        self.vectors = vectors
+        self.timestamps = timestamps
+        self._free.extend(range(capacity - 1, old_capacity - 1, -1))
+
+    def acquire(self) -> Optional[int]:
+        return self._free.pop() if self._free else None
+
+    def release(self, slot: int):
+        self._free.append(slot)
+
 
 class EmbeddingCache:
     _instance = None
-    
-    def __init__(self):
-        self._cache: Dict[str, dict] = {}
-        self._last_cleanup = datetime.now()
-        self.max_cache_age = timedelta(hours=24)  # Cache por 24 horas
-        self.max_cache_size = 10000  # Máximo número de embeddings en cache
-    
+
+    def __init__(self,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 max_cache_age: timedelta = timedelta(hours=24),
+                 initial_capacity: int = 256,
+                 persistent_store: Optional[PersistentEmbeddingStore] = None):
+        # Slot table: key -> (dimension, slot). El orden del OrderedDict es el orden LRU
+        self._slots: "OrderedDict[str, Tuple[int, int]]" = OrderedDict()
+        self._slabs: Dict[int, _EmbeddingSlab] = {}
+        self._lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.max_cache_age = max_cache_age  # Cache por 24 horas
+        self.initial_capacity = initial_capacity
+        # Tier opcional en disco, compartido entre procesos (sin TTL: el embedding
+        # de un texto no cambia para un mismo modelo)
+        self.persistent_store = persistent_store
+        self._used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
     @classmethod
     def get_instance(cls):
         if cls._instance is None:
-            cls._instance = cls()
+            persistent_store = None
+            cache_dir = os.getenv("EMBEDDING_CACHE_DIR")
+            if cache_dir:
+                try:
+                    persistent_store = PersistentEmbeddingStore(
+                        cache_dir,
+                        read_only=os.getenv("EMBEDDING_CACHE_READ_ONLY", "false").lower() == "true"
+                    )
+                except Exception as e:
+                    logger.error(f"Failed to open persistent embedding cache: {str(e)}")
+            cls._instance = cls(
+                max_bytes=int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+                persistent_store=persistent_store
+            )
         return cls._instance
-    
+
     def _generate_key(self, text: str, model: str) -> str:
         """Genera una key única para el texto y modelo"""
         content = f"{text}:{model}"
         return hashlib.md5(content.encode()).hexdigest()
-    
+
     def get(self, text: str, model: str) -> Optional[list]:
         """Obtiene embedding del cache"""
+        vector = self.get_array(text, model)
+        return vector.tolist() if vector is not None else None
+
+    def get_array(self, text: str, model: str) -> Optional[np.ndarray]:
+        """Obtiene una copia float32 del embedding sin convertirlo a lista"""
         key = self._generate_key(text, model)
-        if key in self._cache:
-            entry = self._cache[key]
-            if datetime.now() - entry['timestamp'] < self.max_cache_age:
-                return entry['embedding']
-            del self._cache[key]
-        return None
-    
-    def set(self, text: str, model: str, embedding: list):
+        with self._lock:
+            location = self._slots.get(key)
+            if location is None:
+                return self._get_persistent(key)
+
+            dimension, slot = location
+            slab = self._slabs[dimension]
+            if time.monotonic() - slab.timestamps[slot] >= self.max_cache_age.total_seconds():
+                self._evict(key)
+                return self._get_persistent(key)
+
+            self._slots.move_to_end(key)
+            self.hits += 1
+            return slab.vectors[slot].copy()
+
+    def _get_persistent(self, key: str) -> Optional[np.ndarray]:
+        """Busca en el tier en disco; devuelve una copia para no retener la página mapeada"""
+        vector = None
+        if self.persistent_store is not None:
+            try:
+                vector = self.persistent_store.get(key)
+            except Exception as e:
+                logger.warning(f"Persistent embedding cache read failed: {str(e)}")
+        if vector is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return np.array(vector, dtype=np.float32)
+
+    def set(self, text: str, model: str, embedding):
         """Guarda embedding en cache"""
-        # Limpieza automática si el cache está lleno
-        if len(self._cache) >= self.max_cache_size:
-            self._cleanup()
-            
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        dimension = vector.shape[0]
+        entry_bytes = vector.nbytes
+        if entry_bytes > self.max_bytes:
+            return
+
         key = self._generate_key(text, model)
-        self._cache[key] = {
-            'embedding': embedding,
-            'timestamp': datetime.now()
-        }
-    
+        if self.persistent_store is not None and not self.persistent_store.read_only:
+            try:
+                self.persistent_store.put(key, vector)
+            except Exception as e:
+                logger.warning(f"Persistent embedding cache write failed: {str(e)}")
+
+        with self._lock:
+            if key in self._slots:
+                self._evict(key)
+
+            slab, slot = self._acquire(dimension)
+            if slot is None:
+                return
+
+            slab.vectors[slot] = vector
+            slab.timestamps[slot] = time.monotonic()
+            self._slots[key] = (dimension, slot)
+            self._used_bytes += entry_bytes
+
+    def _allocated_bytes(self) -> int:
+        return sum(slab.vectors.nbytes for slab in self._slabs.values())
+
+    def _acquire(self, dimension: int) -> Tuple[Optional[_EmbeddingSlab], Optional[int]]:
+        """
+        Slot libre para un vector de `dimension`. max_bytes limita la memoria
+        reservada por todos los slabs juntos: si no hay hueco se liberan los
+        slabs vacíos de otras dimensiones y, después, las entradas LRU.
+        """
+        row_bytes = dimension * np.dtype(np.float32).itemsize
+        while True:
+            slab = self._slabs.get(dimension)
+            slot = slab.acquire() if slab is not None else None
+            if slot is not None:
+                return slab, slot
+
+            rows = (self.max_bytes - self._allocated_bytes()) // row_bytes
+            if rows > 0:
+                # Nuevo slab o el doble de capacidad, lo que quepa en el presupuesto
+                if slab is None:
+                    self._slabs[dimension] = _EmbeddingSlab(dimension, min(self.initial_capacity, rows))
+                else:
+                    slab.grow(slab.capacity + min(slab.capacity, rows))
+                continue
+
+            empty = [other for other, candidate in self._slabs.items()
+                     if other != dimension and candidate.is_empty]
+            if empty:
+                for other in empty:
+                    del self._slabs[other]
+            elif self._slots:
+                self._evict(next(iter(self._slots)))
+            else:
+                return None, None
+
+    def _evict(self, key: str):
+        dimension, slot = self._slots.pop(key)
+        slab = self._slabs[dimension]
+        slab.release(slot)
+        self._used_bytes -= dimension * np.dtype(np.float32).itemsize
+
     def _cleanup(self):
         """Limpia entradas antiguas del cache"""
-        current_time = datetime.now()
-        self._cache = {
-            k: v for k, v in self._cache.items()
-            if current_time - v['timestamp'] < self.max_cache_age
-        }
\ No newline at end of file
+        max_age = self.max_cache_age.total_seconds()
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                key for key, (dimension, slot) in self._slots.items()
+                if now - self._slabs[dimension].timestamps[slot] >= max_age
+            ]
+            for key in expired:
+                self._evict(key)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    @property
+    def used_bytes(self) -> int:
+        return self._used_bytes
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas básicas del cache"""
+        return {
+            "entries": len(self._slots),
+            "used_bytes": self._used_bytes,
+            "max_bytes": self.max_bytes,
+            "allocated_bytes": self._allocated_bytes(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "persistent": self.persistent_store.stats() if self.persistent_store else {},
+        }
@@ -0,0 +1,133 @@
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Set, Tuple
+import asyncio
+import hashlib
+import numpy as np
+from app.controllers.logger_controller import logger
+
+EMBEDDING_MODEL = "multilingual-e5-large"
+
+
+class EmbeddingProvider(ABC):
+    model: str = EMBEDDING_MODEL
+
+    @abstractmethod
+    def embed(self, texts: List[str], input_type: str = "passage") -> List[List[float]]:
+        pass
+
+
+class PineconeEmbeddingProvider(EmbeddingProvider):
+    """Embeddings vía pc.inference.embed con un único request por lote"""
+
+    # Límite de inputs por request de Pinecone Inference para multilingual-e5-large
+    max_inputs = 96
+
+    def __init__(self, pc, model: str = EMBEDDING_MODEL):
+        self.pc = pc
+        self.model = model
+
+    def embed(self, texts: List[str], input_type: str = "passage") -> List[List[float]]:
+        values = []
+        for start in range(0, len(texts), self.max_inputs):
+            embeddings = self.pc.inference.embed(
+                model=self.model,
+                inputs=texts[start:start + self.max_inputs],
+                parameters={"input_type": input_type, "truncate": "END"}
+            )
+            values.extend(embedding.values for embedding in embeddings)
+        return values
+
+
+class HashEmbeddingProvider(EmbeddingProvider):
+    """Embeddings deterministas y locales (tests / desarrollo sin red)"""
+
+    def __init__(self, dimension: int = 1024, model: str = "local-hash"):
+        self.dimension = dimension
+        self.model = model
+
+    def embed(self, texts: List[str], input_type: str = "passage") -> List[List[float]]:
+        values = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+            vector /= np.linalg.norm(vector)
+            values.append(vector.tolist())
+        return values
+
+
+class EmbeddingCoalescer:
+    """
+    Agrupa requests de embedding concurrentes durante unos milisegundos (o hasta
+    max_batch_size textos) y los envía en una sola llamada al proveedor.
+    """
+
+    def __init__(self,
+                 provider: EmbeddingProvider,
+                 max_batch_size: int = 96,
+                 max_delay: float = 0.005):
+        self.provider = provider
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._pending: Dict[str, List[Tuple[str, asyncio.Future]]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._flush_tasks: Set[asyncio.Task] = set()
+        self.provider_calls = 0
+        self.requested_texts = 0
+
+    @property
+    def model(self) -> str:
+        return self.provider.model
+
+    async def embed(self, text: str, input_type: str = "passage") -> List[float]:
+        """Encola un texto y espera su embedding"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._pending.setdefault(input_type, [])
+        batch.append((text, future))
+        self.requested_texts += 1
+
+        if len(batch) >= self.max_batch_size:
+            self._schedule_flush(input_type)
+        elif input_type not in self._timers:
+            self._timers[input_type] = loop.call_later(
+                self.max_delay, self._schedule_flush, input_type
+            )
+        return await future
+
+    async def embed_many(self, texts: List[str], input_type: str = "passage") -> List[List[float]]:
+        return list(await asyncio.gather(*(self.embed(text, input_type) for text in texts)))
+
+    def _schedule_flush(self, input_type: str):
+        timer = self._timers.pop(input_type, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(input_type, None)
+        if batch:
+            task = asyncio.ensure_future(self._flush(batch, input_type))
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_tasks.discard)
+
+    async def _flush(self, batch: List[Tuple[str, asyncio.Future]], input_type: str):
+        # Textos repetidos dentro del lote se embeben una sola vez
+        unique_texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            self.provider_calls += 1
+            values = await asyncio.to_thread(self.provider.embed, unique_texts, input_type)
+            by_text = dict(zip(unique_texts, values))
+            for text, future in batch:
+                if not future.done():
+                    future.set_result(by_text[text])
+        except Exception as e:
+            logger.error(f"Batched embedding failed for {len(unique_texts)} texts: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        return {
+            "provider_calls": self.provider_calls,
+            "requested_texts": self.requested_texts,
+            "texts_per_call": (
+                self.requested_texts / self.provider_calls if self.provider_calls else None
+            ),
+        }
@@ -0,0 +1,98 @@
+from typing import Any, Dict, List, Optional
+from collections import OrderedDict
+import threading
+import numpy as np
+from app.models.VectorStore import VectorMatch
+
+
+class HotSetIndex:
+    """
+    Índice en proceso con los vectores escritos o consultados recientemente.
+    El conjunto es pequeño (capacity filas), así que la búsqueda es un producto
+    matriz-vector exacto sobre una matriz float32 normalizada; la eviction es LRU.
+    """
+
+    def __init__(self, capacity: int = 4096, min_confidence: float = 0.9):
+        self.capacity = capacity
+        self.min_confidence = min_confidence
+        self.dimension: Optional[int] = None
+        self._vectors: Optional[np.ndarray] = None
+        self._valid = np.zeros(capacity, dtype=bool)
+        self._slots: "OrderedDict[str, int]" = OrderedDict()
+        self._metadata: List[Optional[Dict[str, Any]]] = [None] * capacity
+        self._ids: List[Optional[str]] = [None] * capacity
+        self._free = list(range(capacity - 1, -1, -1))
+        self._lock = threading.Lock()
+
+    def add(self, item_id: str, values, metadata: Optional[Dict[str, Any]] = None):
+        vector = np.asarray(values, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = vector.shape[0]
+                self._vectors = np.zeros((self.capacity, self.dimension), dtype=np.float32)
+            if vector.shape[0] != self.dimension:
+                return
+
+            slot = self._slots.get(item_id)
+            if slot is None:
+                if not self._free:
+                    _, evicted = self._slots.popitem(last=False)
+                    self._valid[evicted] = False
+                    self._free.append(evicted)
+                slot = self._free.pop()
+                self._slots[item_id] = slot
+            else:
+                self._slots.move_to_end(item_id)
+
+            self._vectors[slot] = vector / norm
+            self._metadata[slot] = dict(metadata or {})
+            self._ids[slot] = item_id
+            self._valid[slot] = True
+
+    def query(self, vector, top_k: int = 5, include_values: bool = False) -> List[VectorMatch]:
+        with self._lock:
+            if self._vectors is None or not self._slots:
+                return []
+            query = np.asarray(vector, dtype=np.float32).ravel()
+            if query.shape[0] != self.dimension:
+                return []
+            norm = np.linalg.norm(query)
+            if norm == 0:
+                return []
+
+            scores = self._vectors @ (query / norm)
+            scores[~self._valid] = -np.inf
+            k = min(top_k, len(self._slots))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+
+            matches = []
+            for slot in top:
+                item_id = self._ids[slot]
+                self._slots.move_to_end(item_id)
+                matches.append(VectorMatch(
+                    id=item_id,
+                    score=float(scores[slot]),
+                    values=self._vectors[slot].tolist() if include_values else None,
+                    metadata=dict(self._metadata[slot])
+                ))
+            return matches
+
+    def is_confident(self, matches: List[VectorMatch], top_k: int) -> bool:
+        """El resultado local basta si hay top_k matches y el peor supera min_confidence"""
+        return len(matches) >= top_k and matches[-1].score >= self.min_confidence
+
+    def discard(self, item_id: str):
+        with self._lock:
+            slot = self._slots.pop(item_id, None)
+            if slot is not None:
+                self._valid[slot] = False
+                self._ids[slot] = None
+                self._metadata[slot] = None
+                self._free.append(slot)
+
+    def __len__(self) -> int:
+        return len(self._slots)
@@ -0,0 +1,240 @@
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Sequence, Tuple
+from collections import deque
+import asyncio
+import os
+import time
+import numpy as np
+from app.controllers.logger_controller import logger
+
+
+class ProviderStats:
+    """Ventana móvil de latencias (primer token y total) y errores de un proveedor"""
+
+    def __init__(self, window: int = 200):
+        self.first_token: Deque[float] = deque(maxlen=window)
+        self.total: Deque[float] = deque(maxlen=window)
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.hedges_lost = 0
+
+    def record_first_token(self, latency: float):
+        self.first_token.append(latency)
+
+    def record_success(self, latency: float):
+        self.total.append(latency)
+        self.outcomes.append(True)
+        self.requests += 1
+
+    def record_error(self):
+        self.outcomes.append(False)
+        self.requests += 1
+        self.errors += 1
+
+    def record_cancelled(self):
+        """El consumidor dejó el stream a medias: no cuenta como éxito ni como error"""
+        self.requests += 1
+        self.cancelled += 1
+
+    @staticmethod
+    def _percentile(samples: Deque[float], q: float) -> Optional[float]:
+        return float(np.percentile(samples, q)) if samples else None
+
+    @property
+    def error_rate(self) -> float:
+        return 1.0 - sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    def first_token_p50(self) -> Optional[float]:
+        return self._percentile(self.first_token, 50)
+
+    def first_token_p95(self) -> Optional[float]:
+        return self._percentile(self.first_token, 95)
+
+    def snapshot(self) -> Dict[str, Optional[float]]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "cancelled": self.cancelled,
+            "error_rate": self.error_rate,
+            "hedges_lost": self.hedges_lost,
+            "first_token_p50": self.first_token_p50(),
+            "first_token_p95": self.first_token_p95(),
+            "total_p50": self._percentile(self.total, 50),
+            "total_p95": self._percentile(self.total, 95),
+        }
+
+
+class LLMRouter:
+    """
+    Router sobre varios modelos de chat (instancias de MultiProviderLLMManager o
+    cualquier objeto con `astream`, p.ej. modelos fake de langchain en tests).
+
+    Ordena los candidatos por salud (tasa de error y p50 del primer token). Si
+    el primario no produce su primer token antes del plazo de hedge, lanza el
+    siguiente en paralelo; gana el primero que emite un token y el otro se
+    cancela. Un candidato que falla antes de emitir nada cede el turno al
+    siguiente (fallback).
+    """
+
+    def __init__(self,
+                 candidates: Sequence[Any],
+                 names: Optional[Sequence[str]] = None,
+                 hedge_delay: Optional[float] = None,
+                 min_hedge_delay: float = 0.25,
+                 first_token_timeout: float = 30.0,
+                 max_error_rate: float = 0.5,
+                 min_samples: int = 20):
+        if not candidates:
+            raise ValueError("LLMRouter needs at least one candidate")
+        self.candidates = list(candidates)
+        self.names = list(names) if names else [self._default_name(c, i) for i, c in enumerate(candidates)]
+        self.default_hedge_delay = hedge_delay if hedge_delay is not None else \
+            float(os.getenv("LLM_HEDGE_DELAY", 2.0))
+        self.min_hedge_delay = min_hedge_delay
+        self.first_token_timeout = first_token_timeout
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+        self.stats: Dict[str, ProviderStats] = {name: ProviderStats() for name in self.names}
+        self.hedged_requests = 0
+        self.fallbacks = 0
+
+    @staticmethod
+    def _default_name(candidate: Any, position: int) -> str:
+        provider = getattr(candidate, "provider", None)
+        base = getattr(provider, "value", None) or type(candidate).__name__
+        return f"{base}_{position}"
+
+    # ------------------------------------------------------------ ordenación
+    def ranked(self) -> List[Tuple[str, Any]]:
+        """Candidatos sanos primero (en orden de configuración si no hay datos), luego por p50"""
+        def key(item):
+            position, name = item
+            stats = self.stats[name]
+            unhealthy = len(stats.outcomes) >= 5 and stats.error_rate > self.max_error_rate
+            p50 = stats.first_token_p50() if len(stats.first_token) >= self.min_samples else None
+            return (unhealthy, p50 if p50 is not None else float("inf"), position)
+
+        order = sorted(enumerate(self.names), key=key)
+        return [(name, self.candidates[position]) for position, name in order]
+
+    def hedge_delay_for(self, name: str) -> float:
+        """Plazo de hedge: p95 del primer token del primario (con mínimo), o el valor por defecto"""
+        stats = self.stats[name]
+        if len(stats.first_token) >= self.min_samples:
+            return max(self.min_hedge_delay, stats.first_token_p95())
+        return self.default_hedge_delay
+
+    # --------------------------------------------------------------- llamadas
+    async def _open(self, name: str, candidate: Any, messages: Any, kwargs: Dict) -> Tuple[str, AsyncIterator, Any, float]:
+        started = time.monotonic()
+        stream = candidate.astream(messages, **kwargs).__aiter__()
+        try:
+            first = await stream.__anext__()
+        except StopAsyncIteration:
+            first = None
+        self.stats[name].record_first_token(time.monotonic() - started)
+        return name, stream, first, started
+
+    @staticmethod
+    async def _discard(task: asyncio.Task):
+        """Cancela un intento perdedor y cierra su stream si llegó a abrirse"""
+        task.cancel()
+        try:
+            _, stream, _, _ = await task
+        except BaseException:
+            return
+        try:
+            await stream.aclose()
+        except Exception:
+            pass
+
+    async def astream(self, messages: Any, **kwargs) -> AsyncIterator[Any]:
+        """Stream de chunks del candidato ganador (hedging + fallback)"""
+        ranked = self.ranked()
+        attempts: Dict[asyncio.Task, str] = {}
+        next_candidate = 0
+        deadline = time.monotonic() + self.first_token_timeout
+        winner = None
+
+        def launch():
+            nonlocal next_candidate
+            name, candidate = ranked[next_candidate]
+            next_candidate += 1
+            attempts[asyncio.ensure_future(self._open(name, candidate, messages, kwargs))] = name
+
+        launch()
+        try:
+            while winner is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError("No provider produced a first token in time")
+                if not attempts:
+                    raise RuntimeError("All LLM providers failed")
+
+                can_hedge = next_candidate < len(ranked)
+                timeout = min(remaining, self.hedge_delay_for(ranked[next_candidate - 1][0])) if can_hedge else remaining
+                done, _ = await asyncio.wait(attempts, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    if can_hedge:
+                        self.hedged_requests += 1
+                        logger.info(f"Hedging LLM request to {ranked[next_candidate][0]}")
+                        launch()
+                    continue
+
+                for task in done:
+                    name = attempts.pop(task)
+                    if task.exception() is not None:
+                        self.stats[name].record_error()
+                        logger.warning(f"LLM provider {name} failed: {str(task.exception())}")
+                        continue
+                    if winner is None:
+                        winner = task.result()
+                    else:
+                        await self._discard(task)
+
+                if winner is None and not attempts and next_candidate < len(ranked):
+                    self.fallbacks += 1
+                    launch()
+        finally:
+            for task, name in attempts.items():
+                if winner is not None:
+                    self.stats[name].hedges_lost += 1
+                await self._discard(task)
+
+        name, stream, first, started = winner
+        try:
+            if first is not None:
+                yield first
+            async for chunk in stream:
+                yield chunk
+        except (asyncio.CancelledError, GeneratorExit):
+            self.stats[name].record_cancelled()
+            raise
+        except Exception:
+            self.stats[name].record_error()
+            raise
+        else:
+            self.stats[name].record_success(time.monotonic() - started)
+        finally:
+            # Cierra el stream (y libera su hueco en el limitador) aunque el
+            # consumidor deje de leer antes del final
+            try:
+                await stream.aclose()
+            except Exception:
+                pass
+
+    async def ainvoke(self, messages: Any, **kwargs) -> Any:
+        """Respuesta completa: los chunks del ganador se concatenan (AIMessageChunk + ...)"""
+        response = None
+        async for chunk in self.astream(messages, **kwargs):
+            response = chunk if response is None else response + chunk
+        return response
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "providers": {name: stats.snapshot() for name, stats in self.stats.items()},
+            "hedged_requests": self.hedged_requests,
+            "fallbacks": self.fallbacks,
+        }
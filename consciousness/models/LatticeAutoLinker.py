@@ -0,0 +1,205 @@
+from typing import Dict, Optional, Tuple
+import numpy as np
+from app.controllers.logger_controller import logger
+from app.models.LatticeGraph import LatticeGraph
+
+
+class AutoLinker:
+    """
+    Crea aristas `similar_to` entre nodos del lattice cuya similitud coseno
+    de embeddings supera `threshold` (como mucho `max_links` por nodo).
+
+    Para un nodo nuevo basta un producto matriz-vector sobre la matriz de
+    embeddings del grafo; a partir de `ann_min_nodes` nodos se usa un índice
+    HNSW de FAISS si está instalado. El modo masivo (`link_all`) recorre la
+    matriz en bloques fila x columna, de modo que la memoria de trabajo es
+    block_size² floats independientemente del tamaño del lattice.
+    """
+
+    def __init__(self,
+                 graph: LatticeGraph,
+                 threshold: float = 0.85,
+                 max_links: int = 5,
+                 relation_type: str = "similar_to",
+                 block_size: int = 4096,
+                 ann_min_nodes: int = 50000,
+                 hnsw_m: int = 32):
+        self.graph = graph
+        self.threshold = threshold
+        self.max_links = max_links
+        self.relation_type = relation_type
+        self.block_size = block_size
+        self.ann_min_nodes = ann_min_nodes
+        self.hnsw_m = hnsw_m
+
+        self._ann = None
+        self._ann_rows = 0
+        self._ann_unavailable = False
+
+        self.links_created = 0
+        self.ann_queries = 0
+        self.exact_queries = 0
+
+    def _normalized(self, rows: np.ndarray) -> np.ndarray:
+        return self.graph.embedding_rows(rows) / self.graph.embedding_norms[rows, None]
+
+    # -------------------------------------------------------------- por nodo
+    def _exact_neighbors(self, index: int) -> Tuple[np.ndarray, np.ndarray]:
+        self.exact_queries += 1
+        candidates = self.graph.embedded_indices()
+        candidates = candidates[candidates != index]
+        if not len(candidates):
+            return candidates, np.zeros(0, dtype=np.float32)
+        query = self._normalized(np.array([index]))[0]
+        scores = (self.graph.embedding_rows(candidates) @ query) / self.graph.embedding_norms[candidates]
+        return candidates, scores
+
+    def _ann_index(self):
+        """Índice HNSW sobre los embeddings normalizados; se amplía con las filas nuevas"""
+        if self._ann_unavailable:
+            return None
+        if self._ann is None:
+            try:
+                import faiss
+            except ImportError:
+                logger.warning("faiss not installed, auto-linking falls back to exact search")
+                self._ann_unavailable = True
+                return None
+            self._ann = faiss.IndexHNSWFlat(self.graph.dimension, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            self._ann_rows = 0
+
+        # Los ids de FAISS son las filas; las filas sin embedding entran como ceros
+        n = self.graph.num_nodes
+        if n > self._ann_rows:
+            rows = np.arange(self._ann_rows, n)
+            block = np.zeros((len(rows), self.graph.dimension), dtype=np.float32)
+            valid = self.graph.has_embedding[rows] & (self.graph.embedding_norms[rows] > 0)
+            block[valid] = self._normalized(rows[valid])
+            self._ann.add(block)
+            self._ann_rows = n
+        return self._ann
+
+    def _ann_neighbors(self, index: int, ann) -> Tuple[np.ndarray, np.ndarray]:
+        self.ann_queries += 1
+        query = self._normalized(np.array([index]))
+        # Sobre-pedimos para descartar el propio nodo y nodos borrados
+        scores, rows = ann.search(query, self.max_links * 4 + 1)
+        rows, scores = rows[0], scores[0]
+        keep = (rows >= 0) & (rows != index)
+        rows, scores = rows[keep], scores[keep]
+        valid = self.graph.node_alive[rows] & self.graph.has_embedding[rows]
+        return rows[valid], scores[valid]
+
+    def link_node(self, index: int) -> int:
+        """Enlaza un nodo con sus vecinos más similares; devuelve las aristas creadas"""
+        if not self.graph.has_embedding[index] or self.graph.embedding_norms[index] == 0:
+            return 0
+
+        ann = self._ann_index() if len(self.graph) >= self.ann_min_nodes else None
+        candidates, scores = self._ann_neighbors(index, ann) if ann is not None else self._exact_neighbors(index)
+
+        above = scores >= self.threshold
+        candidates, scores = candidates[above], scores[above]
+        if len(candidates) > self.max_links:
+            top = np.argpartition(-scores, self.max_links - 1)[:self.max_links]
+            candidates, scores = candidates[top], scores[top]
+
+        existing = self._linked_pairs(index)
+        created = 0
+        for target, score in zip(candidates.tolist(), scores.tolist()):
+            if target in existing:
+                continue
+            self.graph.add_edge(index, target, self.relation_type, weight=score, metadata={"auto": True})
+            created += 1
+        self.links_created += created
+        return created
+
+    def _linked_pairs(self, index: int) -> set:
+        """Nodos ya unidos a `index` por una arista del tipo de relación (en cualquier sentido)"""
+        code = self.graph.relation_codes.get(self.relation_type)
+        if code is None:
+            return set()
+        out_edges = self.graph.out_edges(index)
+        in_edges = self.graph.in_edges(index)
+        linked = self.graph.edge_dst[out_edges[self.graph.edge_rel[out_edges] == code]]
+        linked_in = self.graph.edge_src[in_edges[self.graph.edge_rel[in_edges] == code]]
+        return set(linked.tolist()) | set(linked_in.tolist())
+
+    # ---------------------------------------------------------------- masivo
+    def link_all(self) -> int:
+        """
+        Recalcula los enlaces de todo el lattice por bloques: cada nodo conserva
+        sus `max_links` vecinos más similares sobre el umbral; los pares se
+        deduplican (una arista por par) y se omiten los ya enlazados.
+        """
+        rows = self.graph.embedded_indices()
+        n = len(rows)
+        if n < 2:
+            return 0
+        k = min(self.max_links, n - 1)
+        best_scores = np.full((n, k), -np.inf, dtype=np.float32)
+        best_cols = np.full((n, k), -1, dtype=np.int64)
+
+        for row_start in range(0, n, self.block_size):
+            row_block = slice(row_start, min(row_start + self.block_size, n))
+            left = self._normalized(rows[row_block])
+            for col_start in range(0, n, self.block_size):
+                col_block = slice(col_start, min(col_start + self.block_size, n))
+                scores = left @ self._normalized(rows[col_block]).T
+                if row_start == col_start:
+                    np.fill_diagonal(scores, -np.inf)
+                scores[scores < self.threshold] = -np.inf
+
+                # Fusión del top-k acumulado con el del bloque
+                merged_scores = np.concatenate([best_scores[row_block], scores], axis=1)
+                merged_cols = np.concatenate([
+                    best_cols[row_block],
+                    np.broadcast_to(np.arange(col_block.start, col_block.stop), scores.shape)
+                ], axis=1)
+                top = np.argpartition(-merged_scores, k - 1, axis=1)[:, :k]
+                best_scores[row_block] = np.take_along_axis(merged_scores, top, axis=1)
+                best_cols[row_block] = np.take_along_axis(merged_cols, top, axis=1)
+
+        valid = np.isfinite(best_scores)
+        sources = np.repeat(np.arange(n), k)[valid.ravel()]
+        targets = best_cols[valid]
+        scores = best_scores[valid]
+
+        low, high = np.minimum(sources, targets), np.maximum(sources, targets)
+        keys, first = np.unique(low * n + high, return_index=True)
+        existing = self._existing_keys(rows)
+        fresh = ~np.isin(keys, existing)
+
+        created = 0
+        for key, score in zip(keys[fresh].tolist(), scores[first][fresh].tolist()):
+            self.graph.add_edge(
+                int(rows[key // n]), int(rows[key % n]), self.relation_type,
+                weight=score, metadata={"auto": True}
+            )
+            created += 1
+        self.links_created += created
+        logger.info(f"Auto-linked lattice: {created} {self.relation_type} edges over {n} nodes")
+        return created
+
+    def _existing_keys(self, rows: np.ndarray) -> np.ndarray:
+        """Pares (en posiciones de `rows`) ya unidos por el tipo de relación"""
+        code = self.graph.relation_codes.get(self.relation_type)
+        if code is None:
+            return np.zeros(0, dtype=np.int64)
+        edges = self.graph.alive_edges()
+        edges = edges[self.graph.edge_rel[edges] == code]
+        position = np.full(self.graph.num_nodes, -1, dtype=np.int64)
+        position[rows] = np.arange(len(rows))
+        src = position[self.graph.edge_src[edges]]
+        dst = position[self.graph.edge_dst[edges]]
+        keep = (src >= 0) & (dst >= 0)
+        src, dst = src[keep], dst[keep]
+        return np.minimum(src, dst) * len(rows) + np.maximum(src, dst)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "links_created": self.links_created,
+            "exact_queries": self.exact_queries,
+            "ann_queries": self.ann_queries,
+            "ann_rows": self._ann_rows,
+        }
@@ -0,0 +1,164 @@
+from typing import Callable, Dict, Optional, Tuple
+import numpy as np
+from app.controllers.logger_controller import logger
+from app.models.LatticeGraph import LatticeGraph
+
+
+class CentralityService:
+    """
+    Centralidades de todo el grafo calculadas de una vez sobre los arrays COO
+    del LatticeGraph y cacheadas con la versión del grafo. Cuando el grafo
+    cambia, las métricas iterativas (eigenvector, PageRank) se recalculan
+    arrancando desde el vector anterior, por lo que tras cambios pequeños
+    convergen en pocas iteraciones.
+    """
+
+    METHODS = ("eigenvector", "pagerank", "degree")
+
+    def __init__(self,
+                 graph: LatticeGraph,
+                 max_iter: int = 100,
+                 tol: float = 1.0e-6,
+                 damping: float = 0.85):
+        self.graph = graph
+        self.max_iter = max_iter
+        self.tol = tol
+        self.damping = damping
+        self._cache: Dict[str, Tuple[int, np.ndarray]] = {}
+        self._computers: Dict[str, Callable[[Optional[np.ndarray]], np.ndarray]] = {
+            "eigenvector": self._eigenvector,
+            "pagerank": self._pagerank,
+            "degree": self._degree,
+        }
+
+        self.computations = 0
+        self.iterations = 0
+        self.cache_hits = 0
+
+    def scores(self, method: str = "eigenvector") -> np.ndarray:
+        """Vector de scores indexado por id entero (0 para nodos borrados)"""
+        compute = self._computers.get(method)
+        if compute is None:
+            raise ValueError(f"Unknown centrality method: {method}")
+
+        cached = self._cache.get(method)
+        if cached is not None and cached[0] == self.graph.version:
+            self.cache_hits += 1
+            return cached[1]
+
+        scores = compute(cached[1] if cached is not None else None)
+        self._cache[method] = (self.graph.version, scores)
+        self.computations += 1
+        return scores
+
+    def score(self, node_id: str, method: str = "eigenvector") -> float:
+        index = self.graph.node_index(node_id)
+        return float(self.scores(method)[index])
+
+    def as_dict(self, method: str = "eigenvector") -> Dict[str, float]:
+        scores = self.scores(method)
+        return {self.graph.node_ids[i]: float(scores[i]) for i in self.graph.alive_indices()}
+
+    def invalidate(self):
+        self._cache.clear()
+
+    # ------------------------------------------------------------ internos
+    def _edge_arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        edges = self.graph.alive_edges()
+        return (
+            self.graph.edge_src[edges],
+            self.graph.edge_dst[edges],
+            self.graph.edge_weight[edges].astype(np.float64),
+        )
+
+    def _start_vector(self, previous: Optional[np.ndarray], alive: np.ndarray) -> np.ndarray:
+        """Warm start: reutiliza el vector anterior y completa los nodos nuevos"""
+        n = self.graph.num_nodes
+        start = np.zeros(n, dtype=np.float64)
+        count = int(alive.sum())
+        if not count:
+            return start
+        if previous is None:
+            start[alive] = 1.0 / count
+            return start
+        start[:len(previous)] = previous[:n]
+        fresh = alive & (start <= 0)
+        start[fresh] = start[alive & ~fresh].mean() if (alive & ~fresh).any() else 1.0 / count
+        start[~alive] = 0.0
+        return start
+
+    def _converged(self, x: np.ndarray, x_new: np.ndarray, count: int) -> bool:
+        return float(np.abs(x_new - x).sum()) < count * self.tol
+
+    def _eigenvector(self, previous: Optional[np.ndarray]) -> np.ndarray:
+        """
+        Iteración de potencia desplazada (x + Aᵀx), igual que
+        nx.eigenvector_centrality: converge también en grafos dirigidos
+        acíclicos. Usa aristas sin peso (las paralelas cuentan) como el
+        cálculo original con eigenvector_centrality_numpy.
+        """
+        alive = self.graph.node_alive[:self.graph.num_nodes]
+        count = int(alive.sum())
+        x = self._start_vector(previous, alive)
+        if not count:
+            return x
+        x /= np.linalg.norm(x)
+        src, dst, _ = self._edge_arrays()
+        n = self.graph.num_nodes
+
+        for _ in range(self.max_iter):
+            self.iterations += 1
+            x_new = x + np.bincount(dst, weights=x[src], minlength=n)
+            norm = np.linalg.norm(x_new)
+            if norm == 0:
+                return x_new
+            x_new /= norm
+            if self._converged(x, x_new, count):
+                return x_new
+            x = x_new
+        logger.warning(f"Eigenvector centrality did not converge in {self.max_iter} iterations")
+        return x
+
+    def _pagerank(self, previous: Optional[np.ndarray]) -> np.ndarray:
+        """PageRank ponderado por peso de arista, con nodos colgantes repartidos uniformemente"""
+        alive = self.graph.node_alive[:self.graph.num_nodes]
+        count = int(alive.sum())
+        x = self._start_vector(previous, alive)
+        if not count:
+            return x
+        x /= x.sum()
+        src, dst, weight = self._edge_arrays()
+        n = self.graph.num_nodes
+
+        out_weight = np.bincount(src, weights=weight, minlength=n)
+        dangling = alive & (out_weight == 0)
+        safe_out = np.where(out_weight > 0, out_weight, 1.0)
+        edge_share = weight / safe_out[src]
+        teleport = alive / count
+
+        for _ in range(self.max_iter):
+            self.iterations += 1
+            x_new = self.damping * np.bincount(dst, weights=x[src] * edge_share, minlength=n)
+            x_new += (self.damping * x[dangling].sum() + 1.0 - self.damping) * teleport
+            if self._converged(x, x_new, count):
+                return x_new
+            x = x_new
+        logger.warning(f"PageRank did not converge in {self.max_iter} iterations")
+        return x
+
+    def _degree(self, previous: Optional[np.ndarray]) -> np.ndarray:
+        """Grado (entrada + salida) normalizado por n - 1, como nx.degree_centrality"""
+        n = self.graph.num_nodes
+        count = len(self.graph)
+        src, dst, _ = self._edge_arrays()
+        degree = np.bincount(src, minlength=n) + np.bincount(dst, minlength=n)
+        if count <= 1:
+            return np.where(self.graph.node_alive[:n], 1.0, 0.0) if count else degree.astype(np.float64)
+        return degree / (count - 1)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "computations": self.computations,
+            "iterations": self.iterations,
+            "cache_hits": self.cache_hits,
+        }
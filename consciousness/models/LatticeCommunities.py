@@ -0,0 +1,281 @@
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from app.models.LatticeGraph import LatticeGraph
+
+
+def _symmetric_adjacency(n: int,
+                         src: np.ndarray,
+                         dst: np.ndarray,
+                         weight: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """CSR no dirigido (cada arista aparece en ambos sentidos) con pesos float64"""
+    rows = np.concatenate([src, dst]).astype(np.int64)
+    cols = np.concatenate([dst, src]).astype(np.int64)
+    weights = np.concatenate([weight, weight]).astype(np.float64)
+    order = np.argsort(rows, kind="stable")
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    return indptr, cols[order], weights[order]
+
+
+class CommunityService:
+    """
+    Partición en comunidades (Louvain, no dirigido y ponderado) cacheada por
+    versión del grafo. Tras cambios en el grafo se compara contra el estado
+    anterior (aristas nuevas o borradas, nodos nuevos o borrados) y solo se
+    re-evalúan los nodos afectados con la fase de movimiento local de Louvain
+    partiendo de la partición previa. Si los cambios superan `rebuild_ratio`
+    del grafo se recalcula desde cero.
+    """
+
+    def __init__(self,
+                 graph: LatticeGraph,
+                 resolution: float = 1.0,
+                 rebuild_ratio: float = 0.3,
+                 seed: int = 0):
+        self.graph = graph
+        self.resolution = resolution
+        self.rebuild_ratio = rebuild_ratio
+        self._rng = np.random.default_rng(seed)
+
+        self._version = -1
+        self._membership = np.zeros(0, dtype=np.int64)
+        self._edge_mark = 0
+        self._edge_alive = np.zeros(0, dtype=bool)
+        self._node_alive = np.zeros(0, dtype=bool)
+
+        self.full_runs = 0
+        self.incremental_runs = 0
+        self.moves = 0
+
+    # --------------------------------------------------------------- consulta
+    def membership(self) -> np.ndarray:
+        """Etiqueta de comunidad por id entero (-1 para nodos borrados)"""
+        if self._version != self.graph.version:
+            self._update()
+        return self._membership
+
+    def community_of(self, node_id: str) -> int:
+        return int(self.membership()[self.graph.node_index(node_id)])
+
+    def communities(self) -> Dict[int, List[str]]:
+        membership = self.membership()
+        alive = np.flatnonzero(membership >= 0)
+        order = alive[np.argsort(membership[alive], kind="stable")]
+        labels, starts = np.unique(membership[order], return_index=True)
+        groups = np.split(order, starts[1:])
+        return {
+            int(label): [self.graph.node_ids[i] for i in group]
+            for label, group in zip(labels, groups)
+        }
+
+    def summary_graph(self):
+        """Grafo de comunidades: tamaño y peso interno por nodo, peso entre comunidades por arista"""
+        import networkx as nx
+
+        membership = self.membership()
+        edges = self.graph.alive_edges()
+        src = membership[self.graph.edge_src[edges]]
+        dst = membership[self.graph.edge_dst[edges]]
+        weight = self.graph.edge_weight[edges].astype(np.float64)
+
+        labels = np.unique(membership[membership >= 0])
+        k = int(labels.max()) + 1 if len(labels) else 0
+        sizes = np.bincount(membership[membership >= 0], minlength=k)
+        internal = np.bincount(src[src == dst], weights=weight[src == dst], minlength=k)
+
+        low, high = np.minimum(src, dst), np.maximum(src, dst)
+        crossing = low != high
+        keys, inverse = np.unique(low[crossing] * k + high[crossing], return_inverse=True)
+        between = np.bincount(inverse, weights=weight[crossing], minlength=len(keys))
+
+        summary = nx.Graph()
+        for label in labels:
+            summary.add_node(
+                f"community_{label}",
+                size=int(sizes[label]),
+                internal_weight=float(internal[label])
+            )
+        for key, total in zip(keys.tolist(), between.tolist()):
+            summary.add_edge(f"community_{key // k}", f"community_{key % k}", weight=total)
+        return summary
+
+    def modularity(self) -> float:
+        membership = self.membership()
+        indptr, indices, weights = self._adjacency()
+        n = len(indptr) - 1
+        rows = np.repeat(np.arange(n), np.diff(indptr))
+        degree = np.bincount(rows, weights=weights, minlength=n)
+        m2 = degree.sum()
+        if m2 == 0:
+            return 0.0
+        internal = weights[membership[rows] == membership[indices]].sum()
+        alive = membership >= 0
+        totals = np.bincount(membership[alive], weights=degree[alive])
+        return float(internal / m2 - self.resolution * np.sum((totals / m2) ** 2))
+
+    # ----------------------------------------------------------- actualización
+    def _adjacency(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        edges = self.graph.alive_edges()
+        return _symmetric_adjacency(
+            self.graph.num_nodes,
+            self.graph.edge_src[edges],
+            self.graph.edge_dst[edges],
+            self.graph.edge_weight[edges]
+        )
+
+    def _dirty_nodes(self) -> Optional[np.ndarray]:
+        """Nodos afectados desde la última partición; None si conviene recalcular todo"""
+        graph = self.graph
+        n = graph.num_nodes
+        if not len(self._membership):
+            return None
+
+        mark = self._edge_mark
+        removed = np.flatnonzero(self._edge_alive & ~graph.edge_alive[:mark])
+        added = np.arange(mark, graph.num_edges)
+        added = added[graph.edge_alive[added]]
+        changed = np.concatenate([removed, added])
+
+        previous_nodes = len(self._node_alive)
+        removed_nodes = np.flatnonzero(self._node_alive & ~graph.node_alive[:previous_nodes])
+        new_nodes = np.arange(previous_nodes, n)
+
+        dirty = np.zeros(n, dtype=bool)
+        dirty[graph.edge_src[changed]] = True
+        dirty[graph.edge_dst[changed]] = True
+        dirty[new_nodes] = True
+        # Las aristas de los nodos borrados figuran en `removed`: sus vecinos ya están marcados
+        dirty &= graph.node_alive[:n]
+
+        if dirty.sum() + len(removed_nodes) > self.rebuild_ratio * max(len(graph), 1):
+            return None
+        return np.flatnonzero(dirty)
+
+    def _snapshot_state(self):
+        self._edge_mark = self.graph.num_edges
+        self._edge_alive = self.graph.edge_alive[:self._edge_mark].copy()
+        self._node_alive = self.graph.node_alive[:self.graph.num_nodes].copy()
+        self._version = self.graph.version
+
+    def _update(self):
+        dirty = self._dirty_nodes()
+        n = self.graph.num_nodes
+        alive = self.graph.node_alive[:n]
+        indptr, indices, weights = self._adjacency()
+        degree = np.bincount(np.repeat(np.arange(n), np.diff(indptr)), weights=weights, minlength=n)
+
+        if dirty is None:
+            self._membership = self._louvain(indptr, indices, weights, degree, alive)
+            self.full_runs += 1
+        else:
+            membership = np.full(n, -1, dtype=np.int64)
+            membership[:len(self._membership)] = self._membership
+            next_label = int(membership.max()) + 1 if len(membership) else 0
+            new_nodes = np.flatnonzero(alive & (membership < 0))
+            membership[new_nodes] = np.arange(next_label, next_label + len(new_nodes))
+            membership[~alive] = -1
+            self._local_moving(indptr, indices, weights, degree, membership, dirty)
+            self._membership = self._compact(membership)
+            self.incremental_runs += 1
+        self._snapshot_state()
+
+    @staticmethod
+    def _compact(membership: np.ndarray) -> np.ndarray:
+        """Re-etiqueta a 0..k-1 preservando el orden de las etiquetas"""
+        alive = membership >= 0
+        compacted = np.full_like(membership, -1)
+        if alive.any():
+            _, compacted[alive] = np.unique(membership[alive], return_inverse=True)
+        return compacted
+
+    def _local_moving(self,
+                      indptr: np.ndarray,
+                      indices: np.ndarray,
+                      weights: np.ndarray,
+                      degree: np.ndarray,
+                      membership: np.ndarray,
+                      queue: np.ndarray) -> bool:
+        """Fase de movimiento local de Louvain sobre una cola de nodos; True si hubo movimientos"""
+        m2 = degree.sum()
+        if m2 == 0:
+            return False
+        alive = membership >= 0
+        size = int(membership.max()) + 1 if alive.any() else 0
+        totals = np.bincount(membership[alive], weights=degree[alive], minlength=size)
+        pending = list(self._rng.permutation(queue))
+        queued = np.zeros(len(membership), dtype=bool)
+        queued[queue] = True
+        moved = False
+
+        while pending:
+            node = pending.pop()
+            queued[node] = False
+            start, end = indptr[node], indptr[node + 1]
+            neighbors = indices[start:end]
+            links = weights[start:end]
+            not_self = neighbors != node
+            neighbors, links = neighbors[not_self], links[not_self]
+            if not len(neighbors):
+                continue
+
+            current = membership[node]
+            totals[current] -= degree[node]
+            candidates, inverse = np.unique(membership[neighbors], return_inverse=True)
+            link_weights = np.bincount(inverse, weights=links)
+            gains = link_weights - self.resolution * totals[candidates] * degree[node] / m2
+
+            own = np.flatnonzero(candidates == current)
+            current_gain = gains[own[0]] if len(own) else -self.resolution * totals[current] * degree[node] / m2
+            best = int(np.argmax(gains))
+            if gains[best] > current_gain + 1.0e-12:
+                target = candidates[best]
+                membership[node] = target
+                totals[target] += degree[node]
+                moved = True
+                self.moves += 1
+                requeue = neighbors[(membership[neighbors] != target) & ~queued[neighbors]]
+                queued[requeue] = True
+                pending.extend(requeue.tolist())
+            else:
+                totals[current] += degree[node]
+        return moved
+
+    def _louvain(self,
+                 indptr: np.ndarray,
+                 indices: np.ndarray,
+                 weights: np.ndarray,
+                 degree: np.ndarray,
+                 alive: np.ndarray) -> np.ndarray:
+        """Louvain completo: movimiento local + agregación hasta que no haya mejoras"""
+        n = len(alive)
+        result = np.where(alive, np.arange(n), -1).astype(np.int64)
+        level_alive = alive.copy()
+        while True:
+            level_n = len(level_alive)
+            membership = np.where(level_alive, np.arange(level_n), -1).astype(np.int64)
+            if not self._local_moving(indptr, indices, weights, degree, membership, np.flatnonzero(level_alive)):
+                break
+            membership = self._compact(membership)
+            result = np.where(result >= 0, membership[np.maximum(result, 0)], -1)
+
+            # Agregación: cada comunidad pasa a ser un nodo del siguiente nivel
+            k = int(membership.max()) + 1
+            rows = np.repeat(np.arange(level_n), np.diff(indptr))
+            keys, inverse = np.unique(membership[rows] * k + membership[indices], return_inverse=True)
+            summed = np.bincount(inverse, weights=weights)
+            level_rows, indices = keys // k, keys % k
+            weights = summed
+            indptr = np.zeros(k + 1, dtype=np.int64)
+            np.cumsum(np.bincount(level_rows, minlength=k), out=indptr[1:])
+            degree = np.bincount(level_rows, weights=weights, minlength=k)
+            level_alive = np.ones(k, dtype=bool)
+        return self._compact(result)
+
+    def stats(self) -> Dict[str, int]:
+        membership = self._membership
+        return {
+            "communities": int(membership.max()) + 1 if (membership >= 0).any() else 0,
+            "full_runs": self.full_runs,
+            "incremental_runs": self.incremental_runs,
+            "moves": self.moves,
+        }
@@ -0,0 +1,489 @@
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
+
+
+class NodeRecord:
+    """Registro compacto de un nodo; el embedding vive en la matriz del grafo"""
+    __slots__ = ("id", "text", "metadata", "source", "timestamp", "node_type")
+
+    def __init__(self,
+                 id: str,
+                 text: str,
+                 metadata: Dict[str, Any],
+                 source: str,
+                 timestamp: datetime,
+                 node_type: str):
+        self.id = id
+        self.text = text
+        self.metadata = metadata
+        self.source = source
+        self.timestamp = timestamp
+        self.node_type = node_type
+
+
+def _grow(array: np.ndarray, size: int) -> np.ndarray:
+    """Duplica la capacidad de un array (en el eje 0) hasta que quepan `size` filas"""
+    if size <= array.shape[0]:
+        return array
+    capacity = max(size, array.shape[0] * 2, 16)
+    grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+    grown[:array.shape[0]] = array
+    return grown
+
+
+class LatticeGraph:
+    """
+    Multigrafo dirigido sobre arrays: nodos con ids enteros, aristas en formato
+    COO (src, dst, código de relación, peso float32) e índices CSR de salida y
+    entrada reconstruidos de forma perezosa por versión del grafo. Los
+    embeddings de todos los nodos comparten una sola matriz float32.
+
+    Si la matriz viene mapeada de un snapshot (np.memmap) no se amplía: las
+    filas de nodos añadidos después van a `embedding_overflow`, en RAM, y
+    ambas se funden al escribir el siguiente snapshot. Lee las filas con
+    `embedding_rows` en lugar de indexar `embeddings` directamente.
+
+    Los borrados marcan nodos/aristas como inactivos; los ids enteros no se
+    reutilizan.
+    """
+
+    def __init__(self, initial_nodes: int = 1024, initial_edges: int = 4096):
+        self.node_ids: List[str] = []
+        self.index_of: Dict[str, int] = {}
+        self.records: List[Optional[NodeRecord]] = []
+        self.node_alive = np.zeros(initial_nodes, dtype=bool)
+        self.has_embedding = np.zeros(initial_nodes, dtype=bool)
+        self.embeddings: Optional[np.ndarray] = None
+        self.embedding_overflow: Optional[np.ndarray] = None  # filas >= embeddings.shape[0]
+        self.embedding_norms = np.zeros(initial_nodes, dtype=np.float32)
+        self.dimension: Optional[int] = None
+
+        self.edge_src = np.zeros(initial_edges, dtype=np.int32)
+        self.edge_dst = np.zeros(initial_edges, dtype=np.int32)
+        self.edge_rel = np.zeros(initial_edges, dtype=np.int16)
+        self.edge_weight = np.zeros(initial_edges, dtype=np.float32)
+        self.edge_alive = np.zeros(initial_edges, dtype=bool)
+        self.edge_metadata: Dict[int, Dict[str, Any]] = {}
+        self.num_edges = 0
+
+        self.relation_codes: Dict[str, int] = {}
+        self.relation_names: List[str] = []
+
+        self.version = 0
+        self.journal = None  # Registro de cambios opcional (ver LatticeSnapshot)
+        self._mutations = 0  # Cambia en cada mutación; `version` una vez por lote
+        self._batch_depth = 0
+        self._batch_dirty = False
+        self._csr_version = -1
+        self._out_indptr = self._out_edges = None
+        self._in_indptr = self._in_edges = None
+
+    # ----------------------------------------------------------------- lotes
+    def _touch(self):
+        self._mutations += 1
+        if self._batch_depth:
+            self._batch_dirty = True
+        else:
+            self.version += 1
+
+    @contextmanager
+    def batch(self):
+        """
+        Agrupa mutaciones: `version` (y con ella las caches de centralidad,
+        comunidades, caminos...) cambia una sola vez al cerrar el lote. Los
+        índices CSR internos sí se mantienen al día dentro del lote.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._batch_dirty:
+                self._batch_dirty = False
+                self.version += 1
+
+    # ----------------------------------------------------------------- nodos
+    @property
+    def num_nodes(self) -> int:
+        """Cantidad de ids enteros asignados (incluye nodos borrados)"""
+        return len(self.node_ids)
+
+    def __len__(self) -> int:
+        return len(self.index_of)
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self.index_of
+
+    def node_index(self, node_id: str) -> int:
+        index = self.index_of.get(node_id)
+        if index is None:
+            raise ValueError("Node not found")
+        return index
+
+    def add_node(self, record: NodeRecord, embedding: Optional[Iterable[float]] = None) -> int:
+        if record.id in self.index_of:
+            index = self.index_of[record.id]
+            self.records[index] = record
+        else:
+            index = len(self.node_ids)
+            self.node_ids.append(record.id)
+            self.records.append(record)
+            self.index_of[record.id] = index
+            # Las máscaras por nodo crecen juntas (también las normas, aunque el
+            # nodo no tenga embedding) para poder combinarlas sobre [:num_nodes]
+            self.node_alive = _grow(self.node_alive, index + 1)
+            self.has_embedding = _grow(self.has_embedding, index + 1)
+            self.embedding_norms = _grow(self.embedding_norms, index + 1)
+            self.node_alive[index] = True
+
+        if self.journal is not None:
+            self.journal.record("add_node", record=record)
+        if embedding is not None:
+            self.set_embedding(index, embedding)
+        self._touch()
+        return index
+
+    def set_embedding(self, index: int, embedding: Iterable[float]):
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        if self.embeddings is None:
+            self.dimension = vector.shape[0]
+            self.embeddings = np.zeros((self.node_alive.shape[0], self.dimension), dtype=np.float32)
+        if vector.shape[0] != self.dimension:
+            raise ValueError(f"Embedding dimension {vector.shape[0]} != {self.dimension}")
+        self._reserve_embeddings(index + 1)
+        self.embedding_norms = _grow(self.embedding_norms, index + 1)
+        self._write_embeddings(np.array([index]), vector[None, :])
+        self.embedding_norms[index] = np.linalg.norm(vector)
+        self.has_embedding[index] = True
+        if self.journal is not None:
+            self.journal.record("set_embedding", index=index, vector=vector)
+
+    def set_embeddings(self, indices: np.ndarray, matrix: np.ndarray):
+        """Asigna varios embeddings de una vez (una fila de `matrix` por índice)"""
+        indices = np.asarray(indices, dtype=np.int64)
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if not len(indices):
+            return
+        if self.embeddings is None:
+            self.dimension = matrix.shape[1]
+            self.embeddings = np.zeros((self.node_alive.shape[0], self.dimension), dtype=np.float32)
+        if matrix.shape[1] != self.dimension:
+            raise ValueError(f"Embedding dimension {matrix.shape[1]} != {self.dimension}")
+        size = int(indices.max()) + 1
+        self._reserve_embeddings(size)
+        self.embedding_norms = _grow(self.embedding_norms, size)
+        self._write_embeddings(indices, matrix)
+        self.embedding_norms[indices] = np.linalg.norm(matrix, axis=1)
+        self.has_embedding[indices] = True
+        if self.journal is not None:
+            self.journal.record("set_embeddings", indices=indices, matrix=matrix)
+
+    def _reserve_embeddings(self, size: int):
+        """Filas para los índices < size; una base mapeada no se copia, crece el overflow"""
+        base_rows = self.embeddings.shape[0]
+        if size <= base_rows:
+            return
+        if not isinstance(self.embeddings, np.memmap):
+            self.embeddings = _grow(self.embeddings, size)
+        elif self.embedding_overflow is None:
+            self.embedding_overflow = np.zeros((max(size - base_rows, 16), self.dimension), dtype=np.float32)
+        else:
+            self.embedding_overflow = _grow(self.embedding_overflow, size - base_rows)
+
+    def _write_embeddings(self, indices: np.ndarray, matrix: np.ndarray):
+        base_rows = self.embeddings.shape[0]
+        in_base = indices < base_rows
+        self.embeddings[indices[in_base]] = matrix[in_base]
+        if not in_base.all():
+            self.embedding_overflow[indices[~in_base] - base_rows] = matrix[~in_base]
+
+    @property
+    def embedding_capacity(self) -> int:
+        """Filas de embeddings reservadas (base + overflow)"""
+        if self.embeddings is None:
+            return 0
+        overflow = 0 if self.embedding_overflow is None else self.embedding_overflow.shape[0]
+        return self.embeddings.shape[0] + overflow
+
+    def embedding_rows(self, indices: np.ndarray) -> np.ndarray:
+        """Embeddings de `indices` (copia), leídos de la base y del overflow"""
+        indices = np.asarray(indices, dtype=np.int64)
+        if self.embedding_overflow is None:
+            return self.embeddings[indices]
+        base_rows = self.embeddings.shape[0]
+        in_base = indices < base_rows
+        rows = np.empty((len(indices), self.dimension), dtype=np.float32)
+        rows[in_base] = self.embeddings[indices[in_base]]
+        rows[~in_base] = self.embedding_overflow[indices[~in_base] - base_rows]
+        return rows
+
+    def get_embedding(self, index: int) -> Optional[np.ndarray]:
+        if self.embeddings is None or not self.has_embedding[index]:
+            return None
+        return self.embedding_rows(np.array([index]))[0]
+
+    def remove_nodes(self, node_ids: Sequence[str]) -> int:
+        """Borra varios nodos y sus aristas con una sola pasada sobre el COO"""
+        indices = [self.index_of.pop(node_id) for node_id in node_ids if node_id in self.index_of]
+        if not indices:
+            return 0
+        indices = np.asarray(indices, dtype=np.int64)
+        self.node_alive[indices] = False
+        self.has_embedding[indices] = False
+        for index in indices:
+            self.records[index] = None
+
+        removed = np.zeros(self.num_nodes, dtype=bool)
+        removed[indices] = True
+        edges = slice(0, self.num_edges)
+        incident = removed[self.edge_src[edges]] | removed[self.edge_dst[edges]]
+        self.edge_alive[edges] &= ~incident
+        for edge in np.flatnonzero(incident):
+            self.edge_metadata.pop(int(edge), None)
+        if self.journal is not None:
+            self.journal.record("remove_nodes", ids=[self.node_ids[i] for i in indices])
+        self._touch()
+        return len(indices)
+
+    def embedded_indices(self) -> np.ndarray:
+        """Nodos vivos con embedding de norma no nula"""
+        n = self.num_nodes
+        return np.flatnonzero(self.node_alive[:n] & self.has_embedding[:n] & (self.embedding_norms[:n] > 0))
+
+    def remove_node(self, node_id: str):
+        index = self.index_of.pop(node_id, None)
+        if index is None:
+            raise ValueError("Node not found")
+        self.node_alive[index] = False
+        self.has_embedding[index] = False
+        self.records[index] = None
+
+        edges = slice(0, self.num_edges)
+        incident = (self.edge_src[edges] == index) | (self.edge_dst[edges] == index)
+        self.edge_alive[edges] &= ~incident
+        for edge in np.flatnonzero(incident):
+            self.edge_metadata.pop(int(edge), None)
+        if self.journal is not None:
+            self.journal.record("remove_node", id=node_id)
+        self._touch()
+
+    def alive_indices(self) -> np.ndarray:
+        return np.flatnonzero(self.node_alive[:self.num_nodes])
+
+    # --------------------------------------------------------------- aristas
+    def relation_code(self, relation_type: str) -> int:
+        code = self.relation_codes.get(relation_type)
+        if code is None:
+            code = len(self.relation_names)
+            self.relation_codes[relation_type] = code
+            self.relation_names.append(relation_type)
+        return code
+
+    def add_edge(self,
+                 source: int,
+                 target: int,
+                 relation_type: str,
+                 weight: float = 1.0,
+                 metadata: Optional[Dict[str, Any]] = None) -> int:
+        edge = self.num_edges
+        self._ensure_edge_capacity(edge + 1)
+        self.edge_src[edge] = source
+        self.edge_dst[edge] = target
+        self.edge_rel[edge] = self.relation_code(relation_type)
+        self.edge_weight[edge] = weight
+        self.edge_alive[edge] = True
+        if metadata:
+            self.edge_metadata[edge] = metadata
+        self.num_edges += 1
+        if self.journal is not None:
+            self.journal.record(
+                "add_edge", source=source, target=target, relation_type=relation_type,
+                weight=weight, metadata=metadata
+            )
+        self._touch()
+        return edge
+
+    def add_edges(self,
+                  sources: np.ndarray,
+                  targets: np.ndarray,
+                  relation_types: Sequence[str],
+                  weights: np.ndarray,
+                  metadata: Optional[Sequence[Optional[Dict[str, Any]]]] = None) -> np.ndarray:
+        """Añade un lote de aristas con asignaciones vectorizadas; devuelve sus posiciones"""
+        sources = np.asarray(sources, dtype=np.int32)
+        count = len(sources)
+        start = self.num_edges
+        self._ensure_edge_capacity(start + count)
+        edges = np.arange(start, start + count)
+        self.edge_src[edges] = sources
+        self.edge_dst[edges] = np.asarray(targets, dtype=np.int32)
+        self.edge_rel[edges] = [self.relation_code(relation_type) for relation_type in relation_types]
+        self.edge_weight[edges] = np.asarray(weights, dtype=np.float32)
+        self.edge_alive[edges] = True
+        for edge, edge_metadata in zip(edges.tolist(), metadata or []):
+            if edge_metadata:
+                self.edge_metadata[edge] = edge_metadata
+        self.num_edges += count
+        if self.journal is not None:
+            self.journal.record(
+                "add_edges", sources=sources, targets=targets, relation_types=list(relation_types),
+                weights=weights, metadata=list(metadata) if metadata is not None else None
+            )
+        self._touch()
+        return edges
+
+    def _ensure_edge_capacity(self, size: int):
+        self.edge_src = _grow(self.edge_src, size)
+        self.edge_dst = _grow(self.edge_dst, size)
+        self.edge_rel = _grow(self.edge_rel, size)
+        self.edge_weight = _grow(self.edge_weight, size)
+        self.edge_alive = _grow(self.edge_alive, size)
+
+    def alive_edges(self) -> np.ndarray:
+        return np.flatnonzero(self.edge_alive[:self.num_edges])
+
+    def remove_edges(self, edges: np.ndarray) -> int:
+        edges = np.asarray(edges, dtype=np.int64)
+        edges = edges[self.edge_alive[edges]]
+        if not len(edges):
+            return 0
+        self.edge_alive[edges] = False
+        for edge in edges:
+            self.edge_metadata.pop(int(edge), None)
+        if self.journal is not None:
+            self.journal.record("remove_edges", edges=edges)
+        self._touch()
+        return len(edges)
+
+    def prune(self, weight_threshold: float) -> int:
+        """Elimina (vectorizado) las aristas con peso por debajo del umbral"""
+        edges = slice(0, self.num_edges)
+        weak = np.flatnonzero(self.edge_alive[edges] & (self.edge_weight[edges] < weight_threshold))
+        return self.remove_edges(weak)
+
+    def edge(self, edge: int) -> Tuple[str, str, str, float, Dict[str, Any]]:
+        return (
+            self.node_ids[self.edge_src[edge]],
+            self.node_ids[self.edge_dst[edge]],
+            self.relation_names[self.edge_rel[edge]],
+            float(self.edge_weight[edge]),
+            self.edge_metadata.get(int(edge), {}),
+        )
+
+    # ------------------------------------------------------------------- CSR
+    def _build_csr(self):
+        if self._csr_version == self._mutations:
+            return
+        n = self.num_nodes
+        edges = self.alive_edges()
+        src = self.edge_src[edges]
+        dst = self.edge_dst[edges]
+
+        order = np.argsort(src, kind="stable")
+        self._out_edges = edges[order]
+        self._out_indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=self._out_indptr[1:])
+
+        order = np.argsort(dst, kind="stable")
+        self._in_edges = edges[order]
+        self._in_indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(dst, minlength=n), out=self._in_indptr[1:])
+
+        self._csr_version = self._mutations
+
+    def out_edges(self, index: int) -> np.ndarray:
+        self._build_csr()
+        return self._out_edges[self._out_indptr[index]:self._out_indptr[index + 1]]
+
+    def in_edges(self, index: int) -> np.ndarray:
+        self._build_csr()
+        return self._in_edges[self._in_indptr[index]:self._in_indptr[index + 1]]
+
+    def successors(self, index: int) -> np.ndarray:
+        return np.unique(self.edge_dst[self.out_edges(index)])
+
+    def predecessors(self, index: int) -> np.ndarray:
+        return np.unique(self.edge_src[self.in_edges(index)])
+
+    def expand_out(self, frontier: np.ndarray) -> np.ndarray:
+        """Sucesores de un conjunto de nodos, vectorizado sobre el CSR"""
+        self._build_csr()
+        return np.unique(self.edge_dst[_gather_ranges(self._out_indptr, self._out_edges, frontier)])
+
+    def expand_in(self, frontier: np.ndarray) -> np.ndarray:
+        """Predecesores de un conjunto de nodos, vectorizado sobre el CSR"""
+        self._build_csr()
+        return np.unique(self.edge_src[_gather_ranges(self._in_indptr, self._in_edges, frontier)])
+
+    def neighbors(self, index: int) -> np.ndarray:
+        """Vecinos sin dirección (sucesores y predecesores)"""
+        return np.union1d(
+            self.edge_dst[self.out_edges(index)],
+            self.edge_src[self.in_edges(index)]
+        )
+
+    def _expand(self, frontier: np.ndarray) -> np.ndarray:
+        """Vecinos sin dirección de un conjunto de nodos, vectorizado sobre el CSR"""
+        self._build_csr()
+        out_edges = _gather_ranges(self._out_indptr, self._out_edges, frontier)
+        in_edges = _gather_ranges(self._in_indptr, self._in_edges, frontier)
+        return np.union1d(self.edge_dst[out_edges], self.edge_src[in_edges])
+
+    def k_hop(self, index: int, depth: int = 1) -> np.ndarray:
+        """Nodos a distancia <= depth (ignorando dirección), como nx.ego_graph"""
+        visited = np.zeros(self.num_nodes, dtype=bool)
+        visited[index] = True
+        frontier = np.array([index], dtype=np.int64)
+        for _ in range(depth):
+            if not len(frontier):
+                break
+            candidates = self._expand(frontier)
+            frontier = candidates[~visited[candidates]]
+            visited[frontier] = True
+        return np.flatnonzero(visited)
+
+    def induced_edges(self, nodes: np.ndarray) -> np.ndarray:
+        """Aristas vivas con ambos extremos en `nodes`"""
+        member = np.zeros(self.num_nodes, dtype=bool)
+        member[nodes] = True
+        edges = self.alive_edges()
+        return edges[member[self.edge_src[edges]] & member[self.edge_dst[edges]]]
+
+    # ---------------------------------------------------------------- export
+    def to_networkx(self, nodes: Optional[np.ndarray] = None, include_embeddings: bool = False):
+        """Exporta (todo o un subconjunto) a nx.MultiDiGraph; solo para depuración"""
+        import networkx as nx
+
+        graph = nx.MultiDiGraph()
+        nodes = self.alive_indices() if nodes is None else np.asarray(nodes)
+        for index in nodes:
+            record = self.records[index]
+            attributes = {
+                "id": record.id,
+                "text": record.text,
+                "metadata": record.metadata,
+                "source": record.source,
+                "timestamp": record.timestamp,
+                "node_type": record.node_type,
+            }
+            if include_embeddings and self.has_embedding[index]:
+                attributes["embedding"] = self.get_embedding(index).tolist()
+            graph.add_node(record.id, **attributes)
+
+        for edge in self.induced_edges(nodes):
+            source, target, relation_type, weight, metadata = self.edge(edge)
+            graph.add_edge(source, target, relation_type=relation_type, weight=weight, metadata=metadata)
+        return graph
+
+
+def _gather_ranges(indptr: np.ndarray, values: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """Concatena values[indptr[r]:indptr[r+1]] para cada r en rows sin bucles Python"""
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    total = int(lengths.sum())
+    if not total:
+        return values[:0]
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return values[np.arange(total) + offsets]
@@ -0,0 +1,116 @@
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+import numpy as np
+from app.models.LatticeGraph import LatticeGraph, NodeRecord
+
+
+class NeighborhoodView:
+    """
+    Vista liviana de un vecindario k-hop: ids enteros de nodos y aristas sobre
+    los arrays del grafo. Los atributos (textos, registros, embeddings) se leen
+    del grafo solo cuando se piden; no se copia ningún dict de atributos.
+    """
+    __slots__ = ("graph", "center", "depth", "nodes", "edges", "version")
+
+    def __init__(self, graph: LatticeGraph, center: int, depth: int, nodes: np.ndarray, edges: np.ndarray):
+        self.graph = graph
+        self.center = center
+        self.depth = depth
+        self.nodes = nodes
+        self.edges = edges
+        self.version = graph.version
+
+    @property
+    def is_stale(self) -> bool:
+        return self.version != self.graph.version
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def __contains__(self, node_id: str) -> bool:
+        index = self.graph.index_of.get(node_id)
+        return index is not None and bool(np.isin(index, self.nodes))
+
+    @property
+    def node_ids(self) -> List[str]:
+        return [self.graph.node_ids[i] for i in self.nodes]
+
+    def records(self) -> List[NodeRecord]:
+        return [self.graph.records[i] for i in self.nodes]
+
+    def texts(self, limit: Optional[int] = None) -> List[str]:
+        """Textos de los nodos, empezando por el centro y luego por peso de conexión"""
+        order = self.ranked_nodes()
+        if limit is not None:
+            order = order[:limit]
+        return [self.graph.records[i].text for i in order]
+
+    def ranked_nodes(self) -> np.ndarray:
+        """Nodos ordenados: centro primero, después por peso total de sus aristas en la vista"""
+        weights = self.graph.edge_weight[self.edges].astype(np.float64)
+        position = np.full(self.graph.num_nodes, -1, dtype=np.int64)
+        position[self.nodes] = np.arange(len(self.nodes))
+        strength = np.bincount(position[self.graph.edge_src[self.edges]], weights=weights, minlength=len(self.nodes))
+        strength += np.bincount(position[self.graph.edge_dst[self.edges]], weights=weights, minlength=len(self.nodes))
+        strength[position[self.center]] = np.inf
+        return self.nodes[np.argsort(-strength, kind="stable")]
+
+    def edge_arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """(src, dst, código de relación, peso) de las aristas de la vista"""
+        return (
+            self.graph.edge_src[self.edges],
+            self.graph.edge_dst[self.edges],
+            self.graph.edge_rel[self.edges],
+            self.graph.edge_weight[self.edges],
+        )
+
+    def edge_list(self) -> List[Tuple[str, str, str, float, Dict]]:
+        return [self.graph.edge(edge) for edge in self.edges]
+
+    def embeddings(self) -> Optional[np.ndarray]:
+        """Filas de la matriz de embeddings de los nodos de la vista (copia)"""
+        if self.graph.embeddings is None:
+            return None
+        rows = self.nodes[self.nodes < self.graph.embedding_capacity]
+        return self.graph.embedding_rows(rows)
+
+    def to_networkx(self, include_embeddings: bool = False):
+        return self.graph.to_networkx(self.nodes, include_embeddings=include_embeddings)
+
+
+class NeighborhoodService:
+    """
+    Cache LRU de vecindarios k-hop por (nodo, profundidad). Toda la cache se
+    descarta cuando cambia la versión del grafo.
+    """
+
+    def __init__(self, graph: LatticeGraph, capacity: int = 1024):
+        self.graph = graph
+        self.capacity = capacity
+        self._version = -1
+        self._views: "OrderedDict[Tuple[int, int], NeighborhoodView]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, index: int, depth: int = 1) -> NeighborhoodView:
+        if self._version != self.graph.version:
+            self._views.clear()
+            self._version = self.graph.version
+
+        key = (index, depth)
+        view = self._views.get(key)
+        if view is not None:
+            self._views.move_to_end(key)
+            self.hits += 1
+            return view
+
+        self.misses += 1
+        nodes = self.graph.k_hop(index, depth)
+        view = NeighborhoodView(self.graph, index, depth, nodes, self.graph.induced_edges(nodes))
+        self._views[key] = view
+        if len(self._views) > self.capacity:
+            self._views.popitem(last=False)
+        return view
+
+    def stats(self) -> Dict[str, int]:
+        return {"cached": len(self._views), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,285 @@
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Set, Tuple
+from collections import OrderedDict
+import asyncio
+import heapq
+import time
+import numpy as np
+from app.controllers.logger_controller import logger
+from app.models.LatticeGraph import LatticeGraph
+
+
+class ReachabilityIndex:
+    """
+    Cierre de alcanzabilidad (nodos alcanzables hacia adelante) de los nodos
+    origen más consultados, como bitmaps por id entero. Se invalida entero
+    cuando cambia la versión del grafo; la eviction es LRU.
+    """
+
+    def __init__(self, graph: LatticeGraph, capacity: int = 128, hot_threshold: int = 2):
+        self.graph = graph
+        self.capacity = capacity
+        self.hot_threshold = hot_threshold
+        self._version = -1
+        self._closures: "OrderedDict[int, np.ndarray]" = OrderedDict()
+        self._query_counts: Dict[int, int] = {}
+
+    def _check_version(self):
+        if self._version != self.graph.version:
+            self._closures.clear()
+            self._query_counts.clear()
+            self._version = self.graph.version
+
+    def lookup(self, source: int) -> Optional[np.ndarray]:
+        """Devuelve el cierre si el origen es "caliente"; None si conviene una BFS puntual"""
+        self._check_version()
+        closure = self._closures.get(source)
+        if closure is not None:
+            self._closures.move_to_end(source)
+            return closure
+
+        count = self._query_counts.get(source, 0) + 1
+        self._query_counts[source] = count
+        if count < self.hot_threshold:
+            return None
+
+        closure = np.zeros(self.graph.num_nodes, dtype=bool)
+        closure[source] = True
+        frontier = np.array([source], dtype=np.int64)
+        while len(frontier):
+            candidates = self.graph.expand_out(frontier)
+            frontier = candidates[~closure[candidates]]
+            closure[frontier] = True
+
+        self._closures[source] = closure
+        if len(self._closures) > self.capacity:
+            self._closures.popitem(last=False)
+        return closure
+
+    def __len__(self) -> int:
+        return len(self._closures)
+
+
+class PathQueryEngine:
+    """
+    Consultas de caminos sobre el LatticeGraph con límites explícitos:
+    enumeración perezosa de caminos simples (síncrona o asíncrona) acotada por
+    profundidad, cantidad y tiempo; k caminos más cortos ponderados (Yen) y
+    alcanzabilidad por BFS bidireccional.
+    """
+
+    def __init__(self,
+                 graph: LatticeGraph,
+                 yield_every: int = 256,
+                 reachability_capacity: int = 128):
+        self.graph = graph
+        self.yield_every = yield_every
+        self.reachability = ReachabilityIndex(graph, reachability_capacity) if reachability_capacity else None
+        self._cost_version = -1
+        self._costs: Dict[int, Dict[int, float]] = {}
+
+        self.paths_yielded = 0
+        self.truncated_queries = 0
+
+    # ------------------------------------------------------------ enumeración
+    def _walk(self,
+              source: int,
+              target: int,
+              max_depth: Optional[int],
+              max_paths: Optional[int],
+              timeout: Optional[float]) -> Iterator[Optional[List[int]]]:
+        """
+        DFS iterativo de caminos simples. Emite cada camino encontrado y, cada
+        `yield_every` expansiones, un None que permite ceder el control.
+        """
+        max_depth = max_depth if max_depth is not None else len(self.graph) - 1
+        if max_depth < 1 or (max_paths is not None and max_paths <= 0):
+            return
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        version = self.graph.version
+        found = 0
+        steps = 0
+
+        path = [source]
+        on_path = {source}
+        stack = [iter(self.graph.successors(source).tolist())]
+        while stack:
+            steps += 1
+            if steps % self.yield_every == 0:
+                if deadline is not None and time.monotonic() > deadline:
+                    self.truncated_queries += 1
+                    logger.warning(f"Path enumeration stopped after {timeout}s ({found} paths)")
+                    return
+                if self.graph.version != version:
+                    self.truncated_queries += 1
+                    logger.warning("Graph changed during path enumeration, stopping")
+                    return
+                yield None
+
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+                on_path.discard(path.pop())
+                continue
+            if child in on_path:
+                continue
+            if child == target:
+                found += 1
+                self.paths_yielded += 1
+                yield path + [child]
+                if max_paths is not None and found >= max_paths:
+                    if stack:
+                        self.truncated_queries += 1
+                    return
+                continue
+            if len(path) < max_depth:
+                path.append(child)
+                on_path.add(child)
+                stack.append(iter(self.graph.successors(child).tolist()))
+
+    def iter_paths(self,
+                   source: int,
+                   target: int,
+                   max_depth: Optional[int] = None,
+                   max_paths: Optional[int] = None,
+                   timeout: Optional[float] = None) -> Iterator[List[int]]:
+        """Caminos simples source -> target, generados de a uno"""
+        for path in self._walk(source, target, max_depth, max_paths, timeout):
+            if path is not None:
+                yield path
+
+    async def aiter_paths(self,
+                          source: int,
+                          target: int,
+                          max_depth: Optional[int] = None,
+                          max_paths: Optional[int] = None,
+                          timeout: Optional[float] = None) -> AsyncIterator[List[int]]:
+        """Como iter_paths, cediendo el event loop periódicamente durante la búsqueda"""
+        for path in self._walk(source, target, max_depth, max_paths, timeout):
+            if path is None:
+                await asyncio.sleep(0)
+            else:
+                yield path
+
+    # --------------------------------------------------------- k más cortos
+    def _out_costs(self, node: int) -> Dict[int, float]:
+        """Coste mínimo hacia cada sucesor; coste = 1 / peso (aristas fuertes = cortas)"""
+        if self._cost_version != self.graph.version:
+            self._costs.clear()
+            self._cost_version = self.graph.version
+        costs = self._costs.get(node)
+        if costs is None:
+            edges = self.graph.out_edges(node)
+            costs = {}
+            weights = np.maximum(self.graph.edge_weight[edges], 1.0e-6)
+            for target, cost in zip(self.graph.edge_dst[edges].tolist(), (1.0 / weights).tolist()):
+                if cost < costs.get(target, float("inf")):
+                    costs[target] = cost
+            self._costs[node] = costs
+        return costs
+
+    def _dijkstra(self,
+                  source: int,
+                  target: int,
+                  banned_nodes: Set[int],
+                  banned_edges: Set[Tuple[int, int]]) -> Optional[Tuple[float, List[int]]]:
+        distances = {source: 0.0}
+        previous: Dict[int, int] = {}
+        heap = [(0.0, source)]
+        while heap:
+            distance, node = heapq.heappop(heap)
+            if node == target:
+                path = [target]
+                while path[-1] != source:
+                    path.append(previous[path[-1]])
+                return distance, path[::-1]
+            if distance > distances.get(node, float("inf")):
+                continue
+            for successor, cost in self._out_costs(node).items():
+                if successor in banned_nodes or (node, successor) in banned_edges:
+                    continue
+                candidate = distance + cost
+                if candidate < distances.get(successor, float("inf")):
+                    distances[successor] = candidate
+                    previous[successor] = node
+                    heapq.heappush(heap, (candidate, successor))
+        return None
+
+    def _path_cost(self, path: List[int]) -> float:
+        return sum(self._out_costs(u)[v] for u, v in zip(path, path[1:]))
+
+    def k_shortest_paths(self, source: int, target: int, k: int = 3) -> List[Tuple[List[int], float]]:
+        """Algoritmo de Yen: los k caminos simples de menor coste, en orden"""
+        if k <= 0 or source == target:
+            return []
+        first = self._dijkstra(source, target, set(), set())
+        if first is None:
+            return []
+
+        shortest = [(first[1], first[0])]
+        candidates: List[Tuple[float, List[int]]] = []
+        seen = {tuple(first[1])}
+        while len(shortest) < k:
+            last_path = shortest[-1][0]
+            for i in range(len(last_path) - 1):
+                spur_node = last_path[i]
+                root = last_path[:i + 1]
+                banned_edges = {
+                    (path[i], path[i + 1])
+                    for path, _ in shortest
+                    if len(path) > i + 1 and path[:i + 1] == root
+                }
+                spur = self._dijkstra(spur_node, target, set(root[:-1]), banned_edges)
+                if spur is None:
+                    continue
+                total = root[:-1] + spur[1]
+                if tuple(total) not in seen:
+                    seen.add(tuple(total))
+                    heapq.heappush(candidates, (self._path_cost(total), total))
+            if not candidates:
+                break
+            cost, path = heapq.heappop(candidates)
+            shortest.append((path, cost))
+        return shortest
+
+    # ------------------------------------------------------- alcanzabilidad
+    def reachable(self, source: int, target: int, max_depth: Optional[int] = None) -> bool:
+        """BFS bidireccional (o el índice de alcanzabilidad si el origen es frecuente)"""
+        if source == target:
+            return True
+        if max_depth is None and self.reachability is not None:
+            closure = self.reachability.lookup(source)
+            if closure is not None:
+                return bool(closure[target])
+
+        n = self.graph.num_nodes
+        forward = np.zeros(n, dtype=bool)
+        backward = np.zeros(n, dtype=bool)
+        forward[source] = backward[target] = True
+        forward_frontier = np.array([source], dtype=np.int64)
+        backward_frontier = np.array([target], dtype=np.int64)
+        depth = 0
+        while len(forward_frontier) and len(backward_frontier):
+            if max_depth is not None and depth >= max_depth:
+                return False
+            depth += 1
+            # Se expande siempre el frente más pequeño
+            if len(forward_frontier) <= len(backward_frontier):
+                candidates = self.graph.expand_out(forward_frontier)
+                if backward[candidates].any():
+                    return True
+                forward_frontier = candidates[~forward[candidates]]
+                forward[forward_frontier] = True
+            else:
+                candidates = self.graph.expand_in(backward_frontier)
+                if forward[candidates].any():
+                    return True
+                backward_frontier = candidates[~backward[candidates]]
+                backward[backward_frontier] = True
+        return False
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "paths_yielded": self.paths_yielded,
+            "truncated_queries": self.truncated_queries,
+            "reachability_closures": len(self.reachability) if self.reachability is not None else 0,
+        }
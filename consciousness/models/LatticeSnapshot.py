@@ -0,0 +1,287 @@
+from typing import Any, Dict, Optional
+from datetime import datetime
+import base64
+import json
+import os
+import shutil
+import numpy as np
+from app.controllers.logger_controller import logger
+from app.models.LatticeGraph import LatticeGraph, NodeRecord
+
+_CURRENT = "CURRENT"
+
+
+class LatticeChangeLog:
+    """
+    Registro append-only (JSON lines) de los cambios del grafo desde el último
+    snapshot. Se conecta como `graph.journal`; los embeddings viajan como
+    float32 en base64.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self.records = 0
+
+    def record(self, op: str, **fields: Any):
+        entry: Dict[str, Any] = {"op": op}
+        for key, value in fields.items():
+            if isinstance(value, NodeRecord):
+                entry[key] = {
+                    "id": value.id,
+                    "text": value.text,
+                    "metadata": value.metadata,
+                    "source": value.source,
+                    "timestamp": value.timestamp.isoformat(),
+                    "node_type": value.node_type,
+                }
+            elif isinstance(value, np.ndarray) and key in ("vector", "matrix"):
+                entry[key] = base64.b64encode(value.astype(np.float32).tobytes()).decode("ascii")
+                if key == "matrix":
+                    entry["dimension"] = value.shape[1]
+            elif isinstance(value, np.ndarray):
+                entry[key] = value.tolist()
+            elif isinstance(value, np.generic):
+                entry[key] = value.item()
+            else:
+                entry[key] = value
+        self._file.write(json.dumps(entry, default=str) + "\n")
+        self._file.flush()
+        self.records += 1
+
+    def close(self):
+        self._file.close()
+
+    @staticmethod
+    def replay(path: str, graph: LatticeGraph) -> int:
+        """Aplica el registro sobre el grafo; una última línea truncada se ignora"""
+        if not os.path.exists(path):
+            return 0
+        applied = 0
+        with open(path, encoding="utf-8") as log_file:
+            for line in log_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Ignoring truncated lattice change log entry in {path}")
+                    break
+                _apply(graph, entry)
+                applied += 1
+        return applied
+
+
+def _record_from_json(data: Dict[str, Any]) -> NodeRecord:
+    return NodeRecord(
+        id=data["id"],
+        text=data["text"],
+        metadata=data["metadata"],
+        source=data["source"],
+        timestamp=datetime.fromisoformat(data["timestamp"]),
+        node_type=data["node_type"]
+    )
+
+
+def _apply(graph: LatticeGraph, entry: Dict[str, Any]):
+    op = entry["op"]
+    if op == "add_node":
+        graph.add_node(_record_from_json(entry["record"]))
+    elif op == "set_embedding":
+        vector = np.frombuffer(base64.b64decode(entry["vector"]), dtype=np.float32)
+        graph.set_embedding(entry["index"], vector)
+    elif op == "set_embeddings":
+        matrix = np.frombuffer(base64.b64decode(entry["matrix"]), dtype=np.float32)
+        graph.set_embeddings(entry["indices"], matrix.reshape(-1, entry["dimension"]))
+    elif op == "remove_nodes":
+        graph.remove_nodes(entry["ids"])
+    elif op == "add_edges":
+        graph.add_edges(
+            entry["sources"], entry["targets"], entry["relation_types"],
+            entry["weights"], entry["metadata"]
+        )
+    elif op == "remove_node":
+        if entry["id"] in graph:
+            graph.remove_node(entry["id"])
+    elif op == "add_edge":
+        graph.add_edge(
+            entry["source"], entry["target"], entry["relation_type"],
+            weight=entry["weight"], metadata=entry["metadata"]
+        )
+    elif op == "remove_edges":
+        graph.remove_edges(np.asarray(entry["edges"], dtype=np.int64))
+    else:
+        raise ValueError(f"Unknown lattice change log op: {op}")
+
+
+class LatticeSnapshotStore:
+    """
+    Snapshots columnar de un LatticeGraph en un directorio:
+
+        CURRENT                  número del snapshot vigente
+        snapshot-<n>/nodes.json  tabla de nodos (una lista por columna)
+        snapshot-<n>/edges.npz   src, dst, rel, weight (+ edge_metadata.json)
+        snapshot-<n>/embeddings.npy, embedding_state.npz
+        changelog-<n>.jsonl      cambios posteriores al snapshot <n>
+
+    Los ids enteros se guardan tal cual, con las máscaras de nodos y aristas
+    vivos. Al cargar, la matriz de embeddings se abre con mmap copy-on-write,
+    así que solo se leen del disco las filas que se usan.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _current(self) -> Optional[int]:
+        path = os.path.join(self.directory, _CURRENT)
+        if not os.path.exists(path):
+            return None
+        with open(path) as current_file:
+            return int(current_file.read().strip())
+
+    def changelog_path(self, sequence: int) -> str:
+        return os.path.join(self.directory, f"changelog-{sequence}.jsonl")
+
+    def exists(self) -> bool:
+        return self._current() is not None
+
+    # ---------------------------------------------------------------- guardar
+    def save(self, graph: LatticeGraph) -> int:
+        """Escribe un snapshot nuevo, lo marca como vigente y abre un registro vacío"""
+        previous = self._current()
+        sequence = (previous or 0) + 1
+        final_dir = os.path.join(self.directory, f"snapshot-{sequence}")
+        temp_dir = final_dir + ".tmp"
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        os.makedirs(temp_dir)
+
+        # Se conservan los ids enteros (con lápidas) para que el registro de
+        # cambios posterior, que usa esos ids, se pueda re-aplicar tal cual
+        n, m = graph.num_nodes, graph.num_edges
+        records = graph.records
+        with open(os.path.join(temp_dir, "nodes.json"), "w", encoding="utf-8") as nodes_file:
+            json.dump({
+                "ids": graph.node_ids,
+                "text": [record.text if record else None for record in records],
+                "metadata": [record.metadata if record else None for record in records],
+                "source": [record.source if record else None for record in records],
+                "timestamp": [record.timestamp.isoformat() if record else None for record in records],
+                "node_type": [record.node_type if record else None for record in records],
+                "relations": graph.relation_names,
+            }, nodes_file, default=str)
+
+        np.savez(
+            os.path.join(temp_dir, "edges.npz"),
+            src=graph.edge_src[:m],
+            dst=graph.edge_dst[:m],
+            rel=graph.edge_rel[:m],
+            weight=graph.edge_weight[:m],
+            alive=graph.edge_alive[:m],
+            node_alive=graph.node_alive[:n]
+        )
+        with open(os.path.join(temp_dir, "edge_metadata.json"), "w", encoding="utf-8") as metadata_file:
+            json.dump({str(edge): value for edge, value in graph.edge_metadata.items()}, metadata_file, default=str)
+
+        if graph.embeddings is not None and n:
+            # La base (quizá mapeada del snapshot anterior) y el overflow se
+            # funden escribiendo directamente en el fichero nuevo
+            embeddings = np.lib.format.open_memmap(
+                os.path.join(temp_dir, "embeddings.npy"), mode="w+",
+                dtype=np.float32, shape=(n, graph.dimension)
+            )
+            base_rows = min(n, graph.embeddings.shape[0])
+            embeddings[:base_rows] = graph.embeddings[:base_rows]
+            if graph.embedding_overflow is not None and n > base_rows:
+                extra = min(n - base_rows, graph.embedding_overflow.shape[0])
+                embeddings[base_rows:base_rows + extra] = graph.embedding_overflow[:extra]
+            embeddings.flush()
+            del embeddings
+            np.savez(
+                os.path.join(temp_dir, "embedding_state.npz"),
+                has_embedding=graph.has_embedding[:n],
+                norms=graph.embedding_norms[:n]
+            )
+
+        shutil.rmtree(final_dir, ignore_errors=True)
+        os.replace(temp_dir, final_dir)
+        open(self.changelog_path(sequence), "w").close()
+        current_tmp = os.path.join(self.directory, _CURRENT + ".tmp")
+        with open(current_tmp, "w") as current_file:
+            current_file.write(str(sequence))
+        os.replace(current_tmp, os.path.join(self.directory, _CURRENT))
+
+        if previous is not None:
+            shutil.rmtree(os.path.join(self.directory, f"snapshot-{previous}"), ignore_errors=True)
+            if os.path.exists(self.changelog_path(previous)):
+                os.remove(self.changelog_path(previous))
+        if graph.journal is not None:
+            # El registro anterior queda cubierto por el snapshot nuevo
+            graph.journal.close()
+            graph.journal = LatticeChangeLog(self.changelog_path(sequence))
+        logger.info(f"Lattice snapshot {sequence} saved ({len(graph)} nodes, {len(graph.alive_edges())} edges)")
+        return sequence
+
+    # ----------------------------------------------------------------- cargar
+    def load(self) -> Optional[LatticeGraph]:
+        """Carga el snapshot vigente y re-aplica su registro de cambios"""
+        sequence = self._current()
+        if sequence is None:
+            return None
+        snapshot_dir = os.path.join(self.directory, f"snapshot-{sequence}")
+
+        with open(os.path.join(snapshot_dir, "nodes.json"), encoding="utf-8") as nodes_file:
+            table = json.load(nodes_file)
+        edges = np.load(os.path.join(snapshot_dir, "edges.npz"))
+        n, m = len(table["ids"]), len(edges["src"])
+
+        graph = LatticeGraph(initial_nodes=max(n, 1), initial_edges=max(m, 1))
+        graph.node_ids = list(table["ids"])
+        graph.node_alive[:n] = edges["node_alive"]
+        graph.records = [
+            NodeRecord(
+                id=table["ids"][i],
+                text=table["text"][i],
+                metadata=table["metadata"][i],
+                source=table["source"][i],
+                timestamp=datetime.fromisoformat(table["timestamp"][i]),
+                node_type=table["node_type"][i]
+            ) if graph.node_alive[i] else None
+            for i in range(n)
+        ]
+        graph.index_of = {graph.node_ids[i]: i for i in np.flatnonzero(graph.node_alive[:n]).tolist()}
+
+        embeddings_path = os.path.join(snapshot_dir, "embeddings.npy")
+        if os.path.exists(embeddings_path):
+            graph.embeddings = np.load(embeddings_path, mmap_mode="c")
+            graph.dimension = graph.embeddings.shape[1]
+            state = np.load(os.path.join(snapshot_dir, "embedding_state.npz"))
+            graph.has_embedding[:n] = state["has_embedding"]
+            graph.embedding_norms[:n] = state["norms"]
+
+        graph.edge_src[:m] = edges["src"]
+        graph.edge_dst[:m] = edges["dst"]
+        graph.edge_rel[:m] = edges["rel"]
+        graph.edge_weight[:m] = edges["weight"]
+        graph.edge_alive[:m] = edges["alive"]
+        graph.num_edges = m
+        with open(os.path.join(snapshot_dir, "edge_metadata.json"), encoding="utf-8") as metadata_file:
+            graph.edge_metadata = {int(edge): value for edge, value in json.load(metadata_file).items()}
+        graph.relation_names = list(table["relations"])
+        graph.relation_codes = {name: code for code, name in enumerate(graph.relation_names)}
+        graph.version = 1
+
+        replayed = LatticeChangeLog.replay(self.changelog_path(sequence), graph)
+        logger.info(
+            f"Lattice snapshot {sequence} loaded ({len(graph)} nodes, {len(graph.alive_edges())} edges, {replayed} logged changes)"
+        )
+        return graph
+
+    def attach(self, graph: LatticeGraph) -> LatticeChangeLog:
+        """Conecta al grafo el registro de cambios del snapshot vigente"""
+        if graph.journal is not None:
+            graph.journal.close()
+            graph.journal = None
+        sequence = self._current()
+        if sequence is None:
+            sequence = self.save(graph)
+        graph.journal = LatticeChangeLog(self.changelog_path(sequence))
+        return graph.journal
@@ -1,14 +1,26 @@
 import pandas as pd
 from fastapi import HTTPException
-from typing import List, Dict, Any, Optional
+from typing import Awaitable, List, Dict, Any, Optional, Tuple
 from pinecone import Pinecone, ServerlessSpec
 import os
+import asyncio
+import hashlib
+import re
+import unicodedata
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import datetime, timedelta
 import numpy as np
-from collections import Counter
+from collections import Counter, OrderedDict
 from app.controllers.logger_controller import logger
 from app.models.EmbeddingCache import EmbeddingCache
+from app.models.EmbeddingCoalescer import (
+    EmbeddingCoalescer,
+    EmbeddingProvider,
+    PineconeEmbeddingProvider,
+)
+from app.models.UpsertBuffer import WriteBehindUpsertBuffer
+from app.models.VectorStore import FaissVectorStore, PineconeVectorStore, VectorStore
+from app.models.HotSetIndex import HotSetIndex
 
 class MemoryEntry(BaseModel):
     text: str
@@ -19,29 +31,163 @@ class MemoryEntry(BaseModel):
 class QueryRequest(BaseModel):
     query: str
     top_k: int = 5
-    diversity_threshold: float = 0.7  # Controla qué tan diversos queremos los resultados
+    diversity_threshold: float = 1.0  # Lambda de MMR; < 1.0 activa el re-rank por diversidad
+    include_values: bool = False  # Los vectores solo viajan si el llamador los necesita
     
 class DiversityMetrics(BaseModel):
     source_distribution: Dict[str, float]
     time_distribution: Dict[str, float]
     entropy_score: float
 
+def normalize_text(text: str) -> str:
+    """Normalización usada para los ids: NFKC, minúsculas y espacios colapsados"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip().casefold()
+
+def memory_id(text: str, source: str) -> str:
+    """Id estable (content-addressed) de una memoria, igual en cualquier proceso"""
+    content = f"{source}\x1f{normalize_text(text)}"
+    return hashlib.sha256(content.encode()).hexdigest()[:32]
+
+def mmr_rerank(query_vector, candidate_vectors, top_k: int, lambda_mult: float) -> List[int]:
+    """
+    Maximal Marginal Relevance vectorizado: devuelve los índices de los candidatos
+    elegidos, en orden. lambda_mult=1 equivale al top-k por relevancia pura.
+    """
+    candidates = np.asarray(candidate_vectors, dtype=np.float32)
+    if candidates.ndim != 2 or not len(candidates):
+        return []
+    norms = np.linalg.norm(candidates, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    candidates = candidates / norms
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1.0)
+
+    relevance = candidates @ query
+    similarity = candidates @ candidates.T
+
+    first = int(np.argmax(relevance))
+    selected = [first]
+    available = np.ones(len(candidates), dtype=bool)
+    available[first] = False
+    max_similarity = similarity[first].copy()
+
+    while len(selected) < min(top_k, len(candidates)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+
+    return selected
+
+def _time_bucket(timestamp: Optional[str], now: datetime) -> str:
+    try:
+        age = now - datetime.fromisoformat(str(timestamp))
+    except (TypeError, ValueError):
+        return "unknown"
+    if age <= timedelta(hours=1):
+        return "last_hour"
+    if age <= timedelta(days=1):
+        return "last_day"
+    if age <= timedelta(weeks=1):
+        return "last_week"
+    return "older"
+
+def _normalized_entropy(distribution: Dict[str, float], total: int) -> float:
+    probabilities = np.array(list(distribution.values()), dtype=np.float64)
+    if total <= 1 or not len(probabilities):
+        return 0.0
+    entropy = -(probabilities * np.log2(probabilities)).sum()
+    return float(max(0.0, entropy) / np.log2(total))
+
+def compute_diversity_metrics(matches: List[Any], now: Optional[datetime] = None) -> DiversityMetrics:
+    """Distribución por fuente y por antigüedad; entropy_score normalizado en [0, 1]"""
+    now = now or datetime.now()
+    sources = Counter()
+    times = Counter()
+    for match in matches:
+        metadata = getattr(match, "metadata", None) or {}
+        sources[metadata.get("source", "unknown")] += 1
+        times[_time_bucket(metadata.get("timestamp"), now)] += 1
+
+    total = len(matches)
+    if not total:
+        return DiversityMetrics(source_distribution={}, time_distribution={}, entropy_score=0.0)
+
+    source_distribution = {source: count / total for source, count in sources.items()}
+    time_distribution = {bucket: count / total for bucket, count in times.items()}
+    entropy_score = (
+        _normalized_entropy(source_distribution, total) +
+        _normalized_entropy(time_distribution, total)
+    ) / 2
+    return DiversityMetrics(
+        source_distribution=source_distribution,
+        time_distribution=time_distribution,
+        entropy_score=entropy_score
+    )
+
 class MemoryManager:
+    # Candidatos extra que se piden por resultado cuando se aplica MMR
+    mmr_fetch_factor = 4
+
     def __init__(self, 
                  index_name: str = "sintergia-memory", 
-                 dimension: int = 1536,):
+                 dimension: int = 1536,
+                 embedding_provider: Optional[EmbeddingProvider] = None,
+                 vector_store: Optional[VectorStore] = None):
         self.index_name = index_name
         self.dimension = dimension
         self.embedding_cache = EmbeddingCache.get_instance()  # Inicializar el cache
         self.pc = None
         self.index = None
+        self.embedder = None
+        self.upsert_buffer = None
+        self.store = vector_store
+        self.backend = os.getenv("VECTOR_STORE_BACKEND", "pinecone").lower()
+        self.snapshot_dir = os.getenv("FAISS_SNAPSHOT_DIR")
 
         try:
             self.pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY","pcsk_5Be6QE_HHgb4j6zkxVfL9hGmnLG3dxAnzC7TcuTG7YPrMkMFu8efcZyvJMLzZ97SqduDnh"))
-            self._initialize_index()
+            if self.store is None and self.backend == "pinecone":
+                self._initialize_index()
         except Exception as e:
             logger.error(f"Failed to initialize Pinecone: {str(e)}")
 
+        if self.store is None and self.index is not None:
+            self.store = PineconeVectorStore(self.index)
+        if self.store is None:
+            # Backend local: explícito (VECTOR_STORE_BACKEND=faiss) o Pinecone no disponible
+            self.store = self._create_local_store()
+
+        if self.store is not None:
+            # Los upserts se agrupan y se ejecutan fuera del event loop
+            self.upsert_buffer = WriteBehindUpsertBuffer(self.store)
+
+        # Hot set local delante de un store remoto (con FAISS local no aporta nada)
+        self.hot_set = None
+        if isinstance(self.store, PineconeVectorStore):
+            self.hot_set = HotSetIndex(
+                capacity=int(os.getenv("HOT_SET_CAPACITY", 4096)),
+                min_confidence=float(os.getenv("HOT_SET_MIN_CONFIDENCE", 0.9))
+            )
+        self.hot_set_hits = 0
+        self.remote_queries = 0
+
+        # Dedup en escritura: ids exactos recientes y ventana de near-duplicates
+        self.recent_ids_capacity = 10000
+        self._recent_ids: "OrderedDict[str, asyncio.Future]" = OrderedDict()
+        self.near_duplicate_threshold = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", 0.97))
+        self._recent_window = HotSetIndex(capacity=512, min_confidence=self.near_duplicate_threshold)
+        self.skipped_duplicates = 0
+        self.skipped_near_duplicates = 0
+
+        # Proveedor de embeddings intercambiable (p.ej. HashEmbeddingProvider en tests)
+        if embedding_provider is None and self.pc is not None:
+            embedding_provider = PineconeEmbeddingProvider(self.pc)
+        if embedding_provider is not None:
+            self.embedder = EmbeddingCoalescer(embedding_provider)
+
     def _initialize_index(self):
         """Initialize Pinecone index with better error handling"""
         try:
@@ -67,85 +213,233 @@ class MemoryManager:
             logger.error(f"Failed to initialize Pinecone index: {str(e)}")
             return False
 
-    async def add_to_memory(self, entry: MemoryEntry) -> bool:
+    def _create_local_store(self) -> Optional[FaissVectorStore]:
+        """Crea el vector store FAISS local, restaurando el último snapshot si existe"""
+        try:
+            store = FaissVectorStore(index_type=os.getenv("FAISS_INDEX_TYPE", "flat"))
+            if self.snapshot_dir and os.path.exists(os.path.join(self.snapshot_dir, "records.json")):
+                store.restore(self.snapshot_dir)
+            logger.info(f"Using local FAISS vector store ({store.index_type})")
+            return store
+        except Exception as e:
+            logger.error(f"Failed to initialize FAISS vector store: {str(e)}")
+            return None
+
+    async def embed_text(self, text: str, input_type: str = "passage") -> Optional[List[float]]:
+        """Embedding con cache; los misses concurrentes se agrupan en un solo request"""
+        if self.embedder is None:
+            return None
+
+        # e5 produce vectores distintos para "query" y "passage"
+        cache_model = f"{self.embedder.model}:{input_type}"
+        cached_embedding = self.embedding_cache.get(text, cache_model)
+        if cached_embedding:
+            return cached_embedding
+
+        # Si no está en cache, generar nuevo embedding
+        embedding_values = await self.embedder.embed(text, input_type=input_type)
+        # Guardar en cache
+        self.embedding_cache.set(text, cache_model, embedding_values)
+        return embedding_values
+
+    async def embed_texts(self, texts: List[str], input_type: str = "passage") -> List[Optional[List[float]]]:
+        """Embeddings de varios textos: hits de cache y un único lote para los misses"""
+        if self.embedder is None:
+            return [None] * len(texts)
+
+        cache_model = f"{self.embedder.model}:{input_type}"
+        embeddings = [self.embedding_cache.get(text, cache_model) for text in texts]
+        missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if not embedding))
+        if missing:
+            values = await self.embedder.embed_many(missing, input_type=input_type)
+            by_text = dict(zip(missing, values))
+            for text, embedding_values in by_text.items():
+                self.embedding_cache.set(text, cache_model, embedding_values)
+            embeddings = [embedding or by_text[text] for text, embedding in zip(texts, embeddings)]
+        return embeddings
+
+    async def submit_to_memory(self, entry: MemoryEntry) -> Awaitable[bool]:
+        """
+        Embebe la entrada y la encola en el buffer write-behind.
+        Devuelve un awaitable que se resuelve a True cuando el lote se escribió.
+        """
+        failed = self._resolved(False)
+        ack = None
         try:
             if not entry.timestamp:
                 entry.timestamp = datetime.now()
             
-            cached_embedding = self.embedding_cache.get(entry.text, "multilingual-e5-large")
-
-            if cached_embedding:
-                embedding_values = cached_embedding
-            else:
-                # Si no está en cache, generar nuevo embedding
-                embedding = self.pc.inference.embed(
-                    model="multilingual-e5-large",
-                    inputs=[entry.text],
-                    parameters={"input_type": "passage", "truncate": "END"}
-                )
-                embedding_values = embedding[0].values
-                # Guardar en cache
-                self.embedding_cache.set(entry.text, "multilingual-e5-large", embedding_values)
+            if self.upsert_buffer is None:
+                logger.warning("Vector store not available, skipping memory write")
+                return failed
+
+            entry_id = memory_id(entry.text, entry.source)
+            previous_ack = self._recent_ids.get(entry_id)
+            if previous_ack is not None and not (previous_ack.done() and not previous_ack.result()):
+                # Duplicado exacto (escrito o en curso): ni embedding ni upsert
+                self._recent_ids.move_to_end(entry_id)
+                self.skipped_duplicates += 1
+                return previous_ack
+
+            # Se registra antes de embeber para que escrituras concurrentes del mismo texto esperen a esta
+            ack = asyncio.get_running_loop().create_future()
+            self._remember_id(entry_id, ack)
+
+            embedding_values = await self.embed_text(entry.text, input_type="passage")
+            if embedding_values is None:
+                logger.warning("No embedding provider available, skipping memory write")
+                ack.set_result(False)
+                return ack
+
+            # Un reintento no debe coincidir consigo mismo
+            near_duplicates = [
+                match for match in self._recent_window.query(embedding_values, top_k=2)
+                if match.id != entry_id
+            ][:1]
+            if self._recent_window.is_confident(near_duplicates, 1):
+                logger.info(f"Skipping near-duplicate memory (similar to {near_duplicates[0].id})")
+                self.skipped_near_duplicates += 1
+                ack.set_result(True)
+                return ack
             
-            # Upsert en Pinecone
-            self.index.upsert(
-                vectors=[{
-                    "id": str(hash(f"{entry.text}{entry.timestamp}")),
-                    "values": embedding_values,
-                    "metadata": {
-                        "text": entry.text,
-                        "source": entry.source,
-                        "timestamp": entry.timestamp.isoformat(),
-                        **entry.metadata
-                    }
-                }]
-            )
+            vector = {
+                "id": entry_id,
+                "values": embedding_values,
+                "metadata": {
+                    "text": entry.text,
+                    "source": entry.source,
+                    "timestamp": entry.timestamp.isoformat(),
+                    **entry.metadata
+                }
+            }
+            if self.hot_set is not None:
+                self.hot_set.add(vector["id"], embedding_values, vector["metadata"])
             
-            return True
+            # Upsert en el vector store (write-behind); solo lo escrito entra en la
+            # ventana de near-duplicates
+            def on_written(written: asyncio.Future):
+                result = not written.cancelled() and written.result()
+                if result:
+                    self._recent_window.add(entry_id, embedding_values)
+                elif self.hot_set is not None:
+                    self.hot_set.discard(entry_id)
+                if not ack.done():
+                    ack.set_result(result)
+
+            self.upsert_buffer.submit(vector).add_done_callback(on_written)
+            return ack
             
         except Exception as e:
             logger.error(f"Failed to add to memory: {str(e)}")
-            return False
+            if ack is not None and not ack.done():
+                ack.set_result(False)
+            return failed
+
+    @staticmethod
+    def _resolved(result: bool) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(result)
+        return future
+
+    def _remember_id(self, entry_id: str, ack: asyncio.Future):
+        self._recent_ids[entry_id] = ack
+        self._recent_ids.move_to_end(entry_id)
+        while len(self._recent_ids) > self.recent_ids_capacity:
+            self._recent_ids.popitem(last=False)
+
+    async def add_to_memory(self, entry: MemoryEntry) -> bool:
+        """Añade la entrada y espera la confirmación del lote"""
+        ack = await self.submit_to_memory(entry)
+        return await ack
+
+    async def flush(self):
+        """Escribe todos los vectores pendientes (usar en shutdown)"""
+        if self.upsert_buffer is not None:
+            await self.upsert_buffer.flush()
+        if isinstance(self.store, FaissVectorStore) and self.snapshot_dir:
+            try:
+                await asyncio.to_thread(self.store.snapshot, self.snapshot_dir)
+            except Exception as e:
+                logger.error(f"Failed to snapshot FAISS vector store: {str(e)}")
+
+    def _remember_hit(self, match):
+        """Lleva un match remoto al hot set; sin values se intenta con el cache de embeddings"""
+        values = getattr(match, "values", None)
+        metadata = getattr(match, "metadata", None) or {}
+        if not values and self.embedder is not None and metadata.get("text"):
+            values = self.embedding_cache.get_array(
+                metadata["text"], f"{self.embedder.model}:passage"
+            )
+        if values is not None and len(values):
+            self.hot_set.add(match.id, values, metadata)
 
     async def query_memory(self, query_request: QueryRequest) -> List[dict]:
-        """Query memory with fallback to cache-only if Pinecone fails"""
+        """Query memory against the configured vector store"""
+        matches, _ = await self.query_memory_with_metrics(query_request)
+        return matches
+
+    async def query_memory_with_metrics(self, query_request: QueryRequest) -> Tuple[List[Any], DiversityMetrics]:
+        """
+        Devuelve los resultados y sus DiversityMetrics. El re-rank MMR es
+        opcional: solo con diversity_threshold < 1.0 (usado como lambda) se
+        piden más candidatos y sus vectores.
+        """
         try:
-            if not self.index:  # Si no hay conexión a Pinecone
-                logger.warning("Pinecone not available, using cache only")
-                return []
+            if self.store is None:  # Ni Pinecone ni FAISS disponibles
+                logger.warning("Vector store not available")
+                return [], compute_diversity_metrics([])
 
-            cached_embedding = self.embedding_cache.get(
-                query_request.query, 
-                "multilingual-e5-large"
-            )
+            query_vector = await self.embed_text(query_request.query, input_type="query")
+            if query_vector is None:
+                return [], compute_diversity_metrics([])
             
-            if cached_embedding:
-                query_vector = cached_embedding
-            else:
-                if not self.pc:
-                    return []
-                    
-                query_embedding = self.pc.inference.embed(
-                    model="multilingual-e5-large",
-                    inputs=[query_request.query],
-                    parameters={"input_type": "query"}
+            top_k = query_request.top_k
+            use_mmr = query_request.diversity_threshold < 1.0 and top_k > 1
+            fetch_k = top_k * self.mmr_fetch_factor if use_mmr else top_k
+            include_values = use_mmr or query_request.include_values
+
+            candidates = None
+            if self.hot_set is not None:
+                local_matches = self.hot_set.query(
+                    query_vector,
+                    top_k=fetch_k,
+                    include_values=include_values
                 )
-                query_vector = query_embedding[0].values
-                self.embedding_cache.set(
-                    query_request.query, 
-                    "multilingual-e5-large", 
-                    query_vector
+                if self.hot_set.is_confident(local_matches[:top_k], top_k):
+                    self.hot_set_hits += 1
+                    candidates = local_matches
+
+            if candidates is None:
+                self.remote_queries += 1
+                candidates = await asyncio.to_thread(
+                    self.store.query,
+                    vector=query_vector,
+                    top_k=fetch_k,
+                    include_values=include_values,
+                    include_metadata=True
                 )
-            
-            response = self.index.query(
-                vector=query_vector,
-                top_k=query_request.top_k,
-                include_values=True,
-                include_metadata=True
-            )
-            
-            return response.matches if response else []
+                if self.hot_set is not None:
+                    for match in candidates:
+                        self._remember_hit(match)
+
+            matches = self._rerank(query_vector, candidates, query_request) if use_mmr else candidates[:top_k]
+            return matches, compute_diversity_metrics(matches)
             
         except Exception as e:
             logger.error(f"Failed to query memory: {str(e)}")
-            return []
+            return [], compute_diversity_metrics([])
+
+    def _rerank(self, query_vector, candidates: List[Any], query_request: QueryRequest) -> List[Any]:
+        """Aplica MMR sobre los values devueltos; sin values se queda el orden original"""
+        if len(candidates) <= 1:
+            return list(candidates)
+        values = [getattr(match, "values", None) for match in candidates]
+        if any(not value for value in values):
+            return list(candidates[:query_request.top_k])
+        selected = mmr_rerank(
+            query_vector,
+            values,
+            top_k=query_request.top_k,
+            lambda_mult=query_request.diversity_threshold
+        )
+        return [candidates[i] for i in selected]
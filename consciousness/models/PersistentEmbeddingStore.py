@@ -0,0 +1,207 @@
+from typing import Dict, Optional
+import fcntl
+import os
+import threading
+import numpy as np
+from app.controllers.logger_controller import logger
+
+# Registro del índice: digest md5 (16 bytes) + fila (uint32)
+_INDEX_RECORD = np.dtype([("key", "V16"), ("row", "<u4")])
+
+
+class _DimensionFile:
+    """Par de archivos (vectores + índice) para una dimensión de embedding"""
+
+    def __init__(self, directory: str, dimension: int, read_only: bool, initial_rows: int):
+        self.dimension = dimension
+        self.read_only = read_only
+        self.initial_rows = initial_rows
+        self.vectors_path = os.path.join(directory, f"vectors-{dimension}.f32")
+        self.index_path = os.path.join(directory, f"index-{dimension}.bin")
+        self.lock_path = os.path.join(directory, f"index-{dimension}.lock")
+        self._rows: Dict[bytes, int] = {}
+        self._index_offset = 0
+        self._matrix: Optional[np.memmap] = None
+
+        if not read_only:
+            for path in (self.vectors_path, self.index_path, self.lock_path):
+                if not os.path.exists(path):
+                    open(path, "ab").close()
+
+    @property
+    def row_bytes(self) -> int:
+        return self.dimension * np.dtype(np.float32).itemsize
+
+    def _map(self):
+        """(Re)mapea el archivo de vectores completo en memoria"""
+        if not os.path.exists(self.vectors_path):
+            self._matrix = None
+            return
+        rows = os.path.getsize(self.vectors_path) // self.row_bytes
+        if rows == 0:
+            self._matrix = None
+            return
+        self._matrix = np.memmap(
+            self.vectors_path,
+            dtype=np.float32,
+            mode="r" if self.read_only else "r+",
+            shape=(rows, self.dimension)
+        )
+
+    def refresh_index(self):
+        """Lee los registros añadidos al índice por otros procesos"""
+        if not os.path.exists(self.index_path):
+            return
+        size = os.path.getsize(self.index_path)
+        usable = size - (size % _INDEX_RECORD.itemsize)
+        if usable <= self._index_offset:
+            return
+        with open(self.index_path, "rb") as index_file:
+            index_file.seek(self._index_offset)
+            records = np.frombuffer(index_file.read(usable - self._index_offset), dtype=_INDEX_RECORD)
+        for record in records:
+            self._rows[record["key"].tobytes()] = int(record["row"])
+        self._index_offset = usable
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        row = self._rows.get(key)
+        if row is None:
+            self.refresh_index()
+            row = self._rows.get(key)
+            if row is None:
+                return None
+        if self._matrix is None or row >= self._matrix.shape[0]:
+            self._map()
+            if self._matrix is None or row >= self._matrix.shape[0]:
+                return None
+        return self._matrix[row]
+
+    def put(self, key: bytes, vector: np.ndarray):
+        if self.read_only:
+            raise PermissionError("Persistent embedding store is read-only")
+
+        with open(self.lock_path, "rb") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self.refresh_index()
+                if key in self._rows:
+                    return
+                row = self._index_offset // _INDEX_RECORD.itemsize
+                self._ensure_rows(row + 1)
+                self._matrix[row] = vector
+                self._matrix.flush()
+
+                # El registro del índice se escribe después del vector: un lector
+                # nunca ve una fila sin datos
+                record = np.zeros(1, dtype=_INDEX_RECORD)
+                record["key"] = np.frombuffer(key, dtype="V16")
+                record["row"] = row
+                with open(self.index_path, "ab") as index_file:
+                    index_file.write(record.tobytes())
+                    index_file.flush()
+                    os.fsync(index_file.fileno())
+                self._rows[key] = row
+                self._index_offset += _INDEX_RECORD.itemsize
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _ensure_rows(self, rows: int):
+        """Crece el archivo de vectores duplicando su tamaño"""
+        current = os.path.getsize(self.vectors_path) // self.row_bytes
+        if current < rows:
+            new_rows = max(rows, current * 2, self.initial_rows)
+            with open(self.vectors_path, "r+b") as vectors_file:
+                vectors_file.truncate(new_rows * self.row_bytes)
+            self._matrix = None
+        if self._matrix is None or self._matrix.shape[0] < rows:
+            self._map()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+
+class PersistentEmbeddingStore:
+    """
+    Tier persistente del EmbeddingCache: vectores float32 en archivos
+    memory-mapped con un índice compacto append-only (hash texto+modelo -> fila).
+    Varios workers pueden abrir el mismo directorio en modo solo lectura y
+    compartir las páginas del sistema operativo sin copiar vectores a su heap.
+    """
+
+    def __init__(self, directory: str, read_only: bool = False, initial_rows: int = 1024):
+        self.directory = directory
+        self.read_only = read_only
+        self.initial_rows = initial_rows
+        self._files: Dict[int, _DimensionFile] = {}
+        self._lock = threading.Lock()
+        self._directory_mtime = 0.0
+
+        if not read_only:
+            os.makedirs(directory, exist_ok=True)
+        self.warm_up()
+
+    def _discover(self):
+        """Carga los índices existentes para arrancar con el cache caliente"""
+        if not os.path.isdir(self.directory):
+            return
+        self._directory_mtime = os.path.getmtime(self.directory)
+        for name in os.listdir(self.directory):
+            if name.startswith("index-") and name.endswith(".bin"):
+                try:
+                    dimension = int(name[len("index-"):-len(".bin")])
+                except ValueError:
+                    continue
+                self._get_file(dimension).refresh_index()
+
+    def _discover_new_dimensions(self):
+        """Detecta dimensiones creadas por otro proceso después de arrancar"""
+        if os.path.isdir(self.directory) and os.path.getmtime(self.directory) != self._directory_mtime:
+            self._discover()
+
+    def warm_up(self):
+        self._discover()
+        logger.info(
+            f"Loaded persistent embedding store from {self.directory}: "
+            f"{sum(len(f) for f in self._files.values())} vectors"
+        )
+
+    def _get_file(self, dimension: int) -> _DimensionFile:
+        dimension_file = self._files.get(dimension)
+        if dimension_file is None:
+            dimension_file = _DimensionFile(self.directory, dimension, self.read_only, self.initial_rows)
+            self._files[dimension] = dimension_file
+        return dimension_file
+
+    @staticmethod
+    def _digest(key: str) -> bytes:
+        return bytes.fromhex(key)
+
+    def _lookup(self, digest: bytes) -> Optional[np.ndarray]:
+        for dimension_file in self._files.values():
+            vector = dimension_file.get(digest)
+            if vector is not None:
+                return vector
+        return None
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Devuelve una vista de solo lectura sobre la fila memory-mapped"""
+        digest = self._digest(key)
+        with self._lock:
+            vector = self._lookup(digest)
+            if vector is None:
+                self._discover_new_dimensions()
+                vector = self._lookup(digest)
+            return vector
+
+    def put(self, key: str, vector: np.ndarray):
+        if self.read_only:
+            return
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        with self._lock:
+            self._get_file(vector.shape[0]).put(self._digest(key), vector)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            f"dim_{dimension}": len(dimension_file)
+            for dimension, dimension_file in self._files.items()
+        }
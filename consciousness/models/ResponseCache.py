@@ -0,0 +1,263 @@
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+import hashlib
+import os
+import random
+import time
+import numpy as np
+from langchain_core.messages import AIMessage
+from app.controllers.logger_controller import logger
+
+# (proveedor, modelo, temperatura, hash del system prompt)
+Namespace = Tuple[str, str, Optional[float], str]
+
+
+class _Partition:
+    """Embeddings normalizados (float32) y respuestas de un mismo namespace, en orden de inserción"""
+    __slots__ = ("vectors", "responses", "created", "size")
+
+    def __init__(self, dimension: int, capacity: int = 64):
+        self.vectors = np.zeros((capacity, dimension), dtype=np.float32)
+        self.created = np.zeros(capacity, dtype=np.float64)
+        self.responses: List[str] = []
+        self.size = 0
+
+    def append(self, vector: np.ndarray, response: str, now: float):
+        if self.size == self.vectors.shape[0]:
+            capacity = self.vectors.shape[0] * 2
+            vectors = np.zeros((capacity, self.vectors.shape[1]), dtype=np.float32)
+            vectors[:self.size] = self.vectors[:self.size]
+            created = np.zeros(capacity, dtype=np.float64)
+            created[:self.size] = self.created[:self.size]
+            self.vectors, self.created = vectors, created
+        self.vectors[self.size] = vector
+        self.created[self.size] = now
+        self.responses.append(response)
+        self.size += 1
+
+    def drop_oldest(self, count: int):
+        """Descarta las `count` primeras filas (las más antiguas)"""
+        if count <= 0:
+            return
+        keep = self.size - count
+        self.vectors[:keep] = self.vectors[count:self.size]
+        self.created[:keep] = self.created[count:self.size]
+        del self.responses[:count]
+        self.size = keep
+
+
+class ResponseCache:
+    """
+    Cache semántica de respuestas de LLM. El namespace es exacto (proveedor,
+    modelo, temperatura y hash del system prompt); dentro de él se busca por
+    similitud coseno del embedding del contenido de usuario.
+
+    Un hit sobre `threshold` devuelve una de las respuestas guardadas al azar.
+    Con probabilidad `sample_rate` un hit se trata como miss para generar una
+    respuesta nueva, que se suma al pool y mantiene la variedad.
+    """
+    _instance = None
+
+    def __init__(self,
+                 threshold: float = 0.95,
+                 ttl: float = 3600.0,
+                 sample_rate: float = 0.2,
+                 max_entries: int = 512):
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("sample_rate must be between 0 and 1")
+        self.threshold = threshold
+        self.ttl = ttl
+        self.sample_rate = sample_rate
+        self.max_entries = max_entries
+        self._partitions: Dict[Namespace, _Partition] = {}
+        self.hits = 0
+        self.misses = 0
+        self.sampled = 0
+        self.expired = 0
+        self.uncached = 0
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls(
+                threshold=float(os.getenv("RESPONSE_CACHE_THRESHOLD", 0.95)),
+                ttl=float(os.getenv("RESPONSE_CACHE_TTL", 3600)),
+                sample_rate=float(os.getenv("RESPONSE_CACHE_SAMPLE_RATE", 0.2)),
+                max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 512))
+            )
+        return cls._instance
+
+    @staticmethod
+    def enabled() -> bool:
+        return os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+
+    # ------------------------------------------------------------- namespaces
+    @staticmethod
+    def namespace(provider: str, model: str, temperature: Optional[float], system_prompt: str) -> Namespace:
+        prompt_hash = hashlib.sha256(system_prompt.encode()).hexdigest()
+        return (provider, model, temperature, prompt_hash)
+
+    @classmethod
+    def namespace_for(cls, llm: Any, system_prompt: str) -> Namespace:
+        """Namespace de un MultiProviderLLMManager o de un LLMRouter (todos sus candidatos)"""
+        names = getattr(llm, "names", None)
+        if names is not None:
+            return cls.namespace("router", ",".join(names), None, system_prompt)
+        model = getattr(llm, "llm", llm)
+        provider = getattr(getattr(llm, "provider", None), "value", None) or type(model).__name__
+        model_name = getattr(model, "model_name", None) or getattr(model, "model", None) or ""
+        return cls.namespace(provider, str(model_name), getattr(model, "temperature", None), system_prompt)
+
+    @staticmethod
+    def split_messages(messages: Sequence[Any]) -> Tuple[str, str]:
+        """(system prompt, contenido de usuario) de mensajes langchain o dicts role/content"""
+        system_parts, user_parts = [], []
+        for message in messages:
+            if isinstance(message, dict):
+                role, content = message.get("role"), message.get("content", "")
+            else:
+                role, content = getattr(message, "type", None), message.content
+            (system_parts if role == "system" else user_parts).append(str(content))
+        return "\n".join(system_parts), "\n".join(user_parts)
+
+    # ---------------------------------------------------------------- lookup
+    def _expire(self, partition: _Partition, now: float):
+        # Filas en orden de inserción: las caducadas forman un prefijo
+        stale = int(np.searchsorted(partition.created[:partition.size], now - self.ttl, side="left"))
+        if stale:
+            partition.drop_oldest(stale)
+            self.expired += stale
+
+    @staticmethod
+    def _normalize(embedding: Sequence[float]) -> Optional[np.ndarray]:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    def get(self, namespace: Namespace, embedding: Sequence[float]) -> Optional[str]:
+        """Respuesta cacheada para un embedding similar, o None (miss o muestreo)"""
+        partition = self._partitions.get(namespace)
+        vector = self._normalize(embedding)
+        if partition is None or vector is None or partition.vectors.shape[1] != len(vector):
+            self.misses += 1
+            return None
+
+        self._expire(partition, time.time())
+        scores = partition.vectors[:partition.size] @ vector
+        matches = np.flatnonzero(scores >= self.threshold)
+        if not len(matches):
+            self.misses += 1
+            return None
+        if random.random() < self.sample_rate:
+            self.sampled += 1
+            return None
+        self.hits += 1
+        return partition.responses[int(random.choice(matches))]
+
+    def set(self, namespace: Namespace, embedding: Sequence[float], response: str):
+        vector = self._normalize(embedding)
+        if vector is None or not response:
+            return
+        partition = self._partitions.get(namespace)
+        if partition is None or partition.vectors.shape[1] != len(vector):
+            partition = self._partitions[namespace] = _Partition(len(vector))
+        now = time.time()
+        self._expire(partition, now)
+        partition.drop_oldest(partition.size + 1 - self.max_entries)
+        partition.append(vector, response, now)
+
+    # ----------------------------------------------------------------- invoke
+    async def _lookup(self, llm: Any, messages: Sequence[Any],
+                      embed: Callable[[str], Awaitable[Optional[List[float]]]],
+                      cache_key: Optional[str] = None
+                      ) -> Tuple[Namespace, Optional[List[float]], Optional[str]]:
+        """(namespace, embedding de `cache_key` o del contenido de usuario, respuesta cacheada)"""
+        system_prompt, user_content = self.split_messages(messages)
+        namespace = self.namespace_for(llm, system_prompt)
+        try:
+            embedding = await embed(user_content if cache_key is None else cache_key)
+        except Exception as e:
+            logger.warning(f"Response cache embedding failed: {str(e)}")
+            embedding = None
+        if not embedding:
+            self.uncached += 1
+            return namespace, None, None
+        cached = self.get(namespace, embedding)
+        if cached is not None:
+            logger.info(f"Response cache hit for {namespace[0]}/{namespace[1]}")
+        return namespace, embedding, cached
+
+    async def ainvoke(self,
+                      llm: Any,
+                      messages: Sequence[Any],
+                      embed: Callable[[str], Awaitable[Optional[List[float]]]],
+                      cache_key: Optional[str] = None) -> Any:
+        """
+        `llm.ainvoke(messages)` a través de la cache. `embed` calcula el embedding
+        del contenido de usuario (p.ej. memory_manager.embed_text); si falla, se
+        llama al modelo sin cache. `cache_key` sustituye al contenido de usuario
+        como clave cuando este incluye contexto que no identifica la pregunta
+        (memorias, resúmenes).
+        """
+        if not self.enabled():
+            return await llm.ainvoke(messages)
+
+        namespace, embedding, cached = await self._lookup(llm, messages, embed, cache_key)
+        if cached is not None:
+            return AIMessage(content=cached)
+
+        response = await llm.ainvoke(messages)
+        content = getattr(response, "content", None)
+        if embedding and isinstance(content, str):
+            self.set(namespace, embedding, content)
+        return response
+
+    async def astream(self,
+                      llm: Any,
+                      messages: Sequence[Any],
+                      embed: Callable[[str], Awaitable[Optional[List[float]]]],
+                      cache_key: Optional[str] = None) -> AsyncIterator[Any]:
+        """Como `ainvoke` pero en streaming: un hit se emite como un único chunk"""
+        if not self.enabled():
+            stream = llm.astream(messages)
+            try:
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                await stream.aclose()
+            return
+
+        namespace, embedding, cached = await self._lookup(llm, messages, embed, cache_key)
+        if cached is not None:
+            yield AIMessage(content=cached)
+            return
+
+        parts = []
+        # Si el consumidor deja de leer, el stream del modelo se cierra aquí y
+        # no al recogerlo el GC
+        stream = llm.astream(messages)
+        try:
+            async for chunk in stream:
+                content = getattr(chunk, "content", None)
+                if isinstance(content, str):
+                    parts.append(content)
+                yield chunk
+        finally:
+            await stream.aclose()
+        if embedding:
+            self.set(namespace, embedding, "".join(parts))
+
+    def clear(self):
+        self._partitions.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.sampled
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "sampled": self.sampled,
+            "expired": self.expired,
+            "uncached": self.uncached,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "namespaces": len(self._partitions),
+            "entries": sum(partition.size for partition in self._partitions.values()),
+        }
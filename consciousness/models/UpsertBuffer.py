@@ -0,0 +1,160 @@
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from collections import deque
+import asyncio
+import json
+from app.controllers.logger_controller import logger
+
+
+class WriteBehindUpsertBuffer:
+    """
+    Cola write-behind para upserts de vectores. Agrupa los vectores por cantidad,
+    tamaño y tiempo, y los envía en lote desde un worker que ejecuta el upsert
+    (bloqueante) en un thread, sin bloquear el event loop.
+    """
+
+    def __init__(self,
+                 index,
+                 max_batch_vectors: int = 100,
+                 max_batch_bytes: int = 2 * 1024 * 1024,  # Límite de request de Pinecone
+                 max_delay: float = 1.0,
+                 max_retries: int = 3,
+                 retry_backoff: float = 0.5):
+        self.index = index
+        self.max_batch_vectors = max_batch_vectors
+        self.max_batch_bytes = max_batch_bytes
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+        self._pending: Deque[Tuple[Dict[str, Any], int, asyncio.Future]] = deque()
+        self._pending_bytes = 0
+        self._first_enqueued: Optional[float] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._flush_requested = False
+        self._in_flight: List[asyncio.Future] = []
+
+        self.upserted_vectors = 0
+        self.upsert_calls = 0
+        self.failed_batches = 0
+
+    @staticmethod
+    def _estimate_bytes(vector: Dict[str, Any]) -> int:
+        values_bytes = len(vector.get("values", [])) * 4
+        metadata_bytes = len(json.dumps(vector.get("metadata", {}), default=str))
+        return values_bytes + metadata_bytes + len(str(vector.get("id", "")))
+
+    def submit(self, vector: Dict[str, Any]) -> asyncio.Future:
+        """Encola un vector; el future se resuelve a True/False cuando el lote se escribe"""
+        loop = asyncio.get_running_loop()
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._run())
+
+        ack = loop.create_future()
+        size = self._estimate_bytes(vector)
+        if not self._pending:
+            self._first_enqueued = loop.time()
+        self._pending.append((vector, size, ack))
+        self._pending_bytes += size
+        self._wakeup.set()
+        return ack
+
+    def _batch_ready(self) -> bool:
+        return (
+            len(self._pending) >= self.max_batch_vectors or
+            self._pending_bytes >= self.max_batch_bytes
+        )
+
+    def _take_batch(self) -> Tuple[List[Dict[str, Any]], List[asyncio.Future]]:
+        vectors, acks = [], []
+        batch_bytes = 0
+        while self._pending and len(vectors) < self.max_batch_vectors:
+            vector, size, ack = self._pending[0]
+            if vectors and batch_bytes + size > self.max_batch_bytes:
+                break
+            self._pending.popleft()
+            self._pending_bytes -= size
+            batch_bytes += size
+            vectors.append(vector)
+            acks.append(ack)
+        self._first_enqueued = asyncio.get_running_loop().time() if self._pending else None
+        return vectors, acks
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._pending:
+                self._flush_requested = False
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # Esperar a que el lote se llene o venza el plazo del primer vector
+            while not self._batch_ready() and not self._flush_requested:
+                timeout = self._first_enqueued + self.max_delay - loop.time()
+                if timeout <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+
+            vectors, acks = self._take_batch()
+            self._in_flight = acks
+            success = await self._upsert_with_retry(vectors)
+            self._in_flight = []
+            for ack in acks:
+                if not ack.done():
+                    ack.set_result(success)
+
+    async def _upsert_with_retry(self, vectors: List[Dict[str, Any]]) -> bool:
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.upsert_calls += 1
+                await asyncio.to_thread(self.index.upsert, vectors=vectors)
+                self.upserted_vectors += len(vectors)
+                return True
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self.failed_batches += 1
+                    logger.error(f"Failed to upsert batch of {len(vectors)} vectors: {str(e)}")
+                    return False
+                delay = self.retry_backoff * (2 ** attempt)
+                logger.warning(f"Upsert batch failed ({str(e)}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+        return False
+
+    async def flush(self):
+        """Fuerza el envío de todo lo pendiente y espera sus confirmaciones"""
+        acks = [ack for _, _, ack in self._pending] + list(self._in_flight)
+        if not acks:
+            return
+        self._flush_requested = True
+        self._wakeup.set()
+        await asyncio.gather(*acks, return_exceptions=True)
+
+    async def close(self):
+        await self.flush()
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": len(self._pending),
+            "pending_bytes": self._pending_bytes,
+            "upsert_calls": self.upsert_calls,
+            "upserted_vectors": self.upserted_vectors,
+            "failed_batches": self.failed_batches,
+        }
@@ -0,0 +1,313 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+import json
+import os
+import threading
+import numpy as np
+from app.controllers.logger_controller import logger
+
+
+@dataclass
+class VectorMatch:
+    """Resultado de búsqueda con la misma forma que los matches de Pinecone"""
+    id: str
+    score: float
+    values: Optional[List[float]] = None
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+
+class VectorStore(ABC):
+    @abstractmethod
+    def upsert(self, vectors: List[Dict[str, Any]]):
+        pass
+
+    @abstractmethod
+    def query(self,
+              vector: List[float],
+              top_k: int = 5,
+              include_values: bool = False,
+              include_metadata: bool = True) -> List[Any]:
+        pass
+
+    @abstractmethod
+    def delete(self, ids: List[str]):
+        pass
+
+    def snapshot(self, path: str):
+        raise NotImplementedError(f"{type(self).__name__} does not support snapshots")
+
+    def restore(self, path: str):
+        raise NotImplementedError(f"{type(self).__name__} does not support snapshots")
+
+
+class PineconeVectorStore(VectorStore):
+    """Adaptador sobre un índice de Pinecone"""
+
+    def __init__(self, index):
+        self.index = index
+
+    def upsert(self, vectors: List[Dict[str, Any]]):
+        self.index.upsert(vectors=vectors)
+
+    def query(self,
+              vector: List[float],
+              top_k: int = 5,
+              include_values: bool = False,
+              include_metadata: bool = True) -> List[Any]:
+        response = self.index.query(
+            vector=vector,
+            top_k=top_k,
+            include_values=include_values,
+            include_metadata=include_metadata
+        )
+        return response.matches if response else []
+
+    def delete(self, ids: List[str]):
+        self.index.delete(ids=ids)
+
+
+class FaissVectorStore(VectorStore):
+    """
+    Vector store local sobre FAISS (similitud coseno vía producto interno sobre
+    vectores normalizados). Soporta índices "flat", "ivf" y "hnsw".
+
+    Los vectores se guardan también en una matriz float32 propia: permite
+    devolver values, reconstruir el índice tras borrados y hacer snapshots
+    sin depender del tipo de índice. Los borrados son lápidas que se compactan
+    cuando superan `compact_ratio` del total.
+    """
+
+    def __init__(self,
+                 dimension: Optional[int] = None,
+                 index_type: str = "flat",
+                 nlist: int = 100,
+                 nprobe: int = 8,
+                 hnsw_m: int = 32,
+                 compact_ratio: float = 0.25):
+        if index_type not in ("flat", "ivf", "hnsw"):
+            raise ValueError(f"Tipo de índice FAISS no soportado: {index_type}")
+        import faiss
+        self._faiss = faiss
+
+        self.dimension = dimension
+        self.index_type = index_type
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.compact_ratio = compact_ratio
+
+        self._lock = threading.RLock()
+        self._vectors = np.empty((0, dimension or 0), dtype=np.float32)
+        self._size = 0
+        self._ids: List[Optional[str]] = []
+        self._metadata: List[Optional[Dict[str, Any]]] = []
+        self._row_by_id: Dict[str, int] = {}
+        self._deleted = 0
+        self._index = None
+
+    # ---------------------------------------------------------------- índice
+    def _new_index(self):
+        faiss = self._faiss
+        if self.index_type == "flat":
+            return faiss.IndexIDMap2(faiss.IndexFlatIP(self.dimension))
+        if self.index_type == "hnsw":
+            return faiss.IndexIDMap2(
+                faiss.IndexHNSWFlat(self.dimension, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            )
+        quantizer = faiss.IndexFlatIP(self.dimension)
+        index = faiss.IndexIVFFlat(quantizer, self.dimension, self.nlist, faiss.METRIC_INNER_PRODUCT)
+        index.nprobe = self.nprobe
+        return index
+
+    def _ivf_ready(self) -> bool:
+        # FAISS recomienda ~39 vectores de entrenamiento por centroide
+        return len(self._row_by_id) >= self.nlist * 39
+
+    def _rebuild(self):
+        """Compacta las filas vivas y reconstruye el índice FAISS"""
+        live_rows = np.array(
+            [row for row in range(self._size) if self._ids[row] is not None],
+            dtype=np.int64
+        )
+        self._vectors = self._vectors[live_rows].copy() if len(live_rows) else \
+            np.empty((0, self.dimension), dtype=np.float32)
+        self._ids = [self._ids[row] for row in live_rows]
+        self._metadata = [self._metadata[row] for row in live_rows]
+        self._size = len(live_rows)
+        self._row_by_id = {item_id: row for row, item_id in enumerate(self._ids)}
+        self._deleted = 0
+        self._index = None
+
+        if self.index_type == "ivf" and not self._ivf_ready():
+            # Hasta tener datos suficientes para entrenar se busca por fuerza bruta
+            return
+        index = self._new_index()
+        if self._size:
+            if self.index_type == "ivf":
+                index.train(self._vectors)
+            index.add_with_ids(self._vectors, np.arange(self._size, dtype=np.int64))
+        self._index = index
+
+    def _ensure_capacity(self, rows: int):
+        if rows <= self._vectors.shape[0]:
+            return
+        capacity = max(rows, self._vectors.shape[0] * 2, 1024)
+        vectors = np.empty((capacity, self.dimension), dtype=np.float32)
+        vectors[:self._size] = self._vectors[:self._size]
+        self._vectors = vectors
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    # ------------------------------------------------------------ operaciones
+    def upsert(self, vectors: List[Dict[str, Any]]):
+        if not vectors:
+            return
+        # Si un id se repite dentro del lote gana la última versión
+        vectors = list({vector["id"]: vector for vector in vectors}.values())
+        matrix = np.asarray([vector["values"] for vector in vectors], dtype=np.float32)
+        matrix = self._normalize(matrix)
+
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = matrix.shape[1]
+                self._vectors = np.empty((0, self.dimension), dtype=np.float32)
+            if matrix.shape[1] != self.dimension:
+                raise ValueError(
+                    f"Dimensión {matrix.shape[1]} no coincide con el índice ({self.dimension})"
+                )
+
+            self._delete_locked([vector["id"] for vector in vectors if vector["id"] in self._row_by_id])
+
+            start = self._size
+            self._ensure_capacity(start + len(vectors))
+            self._vectors[start:start + len(vectors)] = matrix
+            for offset, vector in enumerate(vectors):
+                self._ids.append(vector["id"])
+                self._metadata.append(dict(vector.get("metadata", {})))
+                self._row_by_id[vector["id"]] = start + offset
+            self._size += len(vectors)
+
+            if self._index is None:
+                if self.index_type != "ivf" or self._ivf_ready():
+                    self._rebuild()
+            else:
+                self._index.add_with_ids(
+                    matrix, np.arange(start, start + len(vectors), dtype=np.int64)
+                )
+            self._maybe_compact()
+
+    def query(self,
+              vector: List[float],
+              top_k: int = 5,
+              include_values: bool = False,
+              include_metadata: bool = True) -> List[VectorMatch]:
+        with self._lock:
+            if not self._row_by_id:
+                return []
+            query = self._normalize(np.asarray(vector, dtype=np.float32).reshape(1, -1))
+
+            if self._index is None:
+                scores = self._vectors[:self._size] @ query[0]
+                rows = np.argsort(-scores)
+                pairs = [(int(row), float(scores[row])) for row in rows]
+            else:
+                # Sobre-pedimos para compensar las lápidas
+                fetch = min(self._size, top_k + self._deleted)
+                scores, rows = self._index.search(query, fetch)
+                pairs = [(int(row), float(score)) for row, score in zip(rows[0], scores[0]) if row >= 0]
+
+            matches = []
+            for row, score in pairs:
+                item_id = self._ids[row]
+                if item_id is None:
+                    continue
+                matches.append(VectorMatch(
+                    id=item_id,
+                    score=score,
+                    values=self._vectors[row].tolist() if include_values else None,
+                    metadata=dict(self._metadata[row]) if include_metadata else {}
+                ))
+                if len(matches) >= top_k:
+                    break
+            return matches
+
+    def fetch(self, ids: List[str]) -> Dict[str, VectorMatch]:
+        with self._lock:
+            return {
+                item_id: VectorMatch(
+                    id=item_id,
+                    score=1.0,
+                    values=self._vectors[self._row_by_id[item_id]].tolist(),
+                    metadata=dict(self._metadata[self._row_by_id[item_id]])
+                )
+                for item_id in ids if item_id in self._row_by_id
+            }
+
+    def delete(self, ids: List[str]):
+        with self._lock:
+            self._delete_locked(ids)
+            self._maybe_compact()
+
+    def _delete_locked(self, ids: List[str]):
+        for item_id in ids:
+            row = self._row_by_id.pop(item_id, None)
+            if row is None:
+                continue
+            self._ids[row] = None
+            self._metadata[row] = None
+            self._deleted += 1
+
+    def _maybe_compact(self):
+        if self._size and self._deleted / self._size > self.compact_ratio:
+            self._rebuild()
+
+    def __len__(self) -> int:
+        return len(self._row_by_id)
+
+    # -------------------------------------------------------------- snapshots
+    def snapshot(self, path: str):
+        """Guarda vectores, metadata e índice FAISS en un directorio"""
+        with self._lock:
+            os.makedirs(path, exist_ok=True)
+            if self._deleted:
+                self._rebuild()
+            np.save(os.path.join(path, "vectors.npy"), self._vectors[:self._size])
+            with open(os.path.join(path, "records.json"), "w") as records_file:
+                json.dump({
+                    "dimension": self.dimension,
+                    "index_type": self.index_type,
+                    "ids": self._ids,
+                    "metadata": self._metadata,
+                }, records_file, default=str)
+            index_path = os.path.join(path, "index.faiss")
+            if self._index is not None:
+                self._faiss.write_index(self._index, index_path)
+            elif os.path.exists(index_path):
+                os.remove(index_path)
+            logger.info(f"FAISS snapshot saved to {path} ({self._size} vectors)")
+
+    def restore(self, path: str):
+        with self._lock:
+            with open(os.path.join(path, "records.json")) as records_file:
+                records = json.load(records_file)
+            self.dimension = records["dimension"]
+            self._vectors = np.load(os.path.join(path, "vectors.npy"))
+            self._size = self._vectors.shape[0]
+            self._ids = records["ids"]
+            self._metadata = records["metadata"]
+            self._row_by_id = {item_id: row for row, item_id in enumerate(self._ids)}
+            self._deleted = 0
+
+            index_path = os.path.join(path, "index.faiss")
+            if records["index_type"] == self.index_type and os.path.exists(index_path):
+                self._index = self._faiss.read_index(index_path)
+                if self.index_type == "ivf":
+                    self._faiss.extract_index_ivf(self._index).nprobe = self.nprobe
+            elif self.dimension is not None:
+                self._rebuild()
+            logger.info(f"FAISS snapshot restored from {path} ({self._size} vectors)")
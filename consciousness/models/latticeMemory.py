@@ -1,8 +1,23 @@
-from typing import List, Dict, Any, Optional, Set
+from typing import List, Dict, Any, Optional, Set, Tuple, AsyncIterator
+import asyncio
+from collections.abc import Mapping
 from pydantic import BaseModel
 from datetime import datetime
+import os
 import networkx as nx
-from collections import defaultdict
+import numpy as np
+from app.models.Memorymanager import MemoryEntry, QueryRequest, memory_id
+from app.models.LatticeGraph import LatticeGraph, NodeRecord
+from app.models.LatticeCentrality import CentralityService
+from app.models.LatticePaths import PathQueryEngine
+from app.models.LatticeCommunities import CommunityService
+from app.models.LatticeAutoLinker import AutoLinker
+from app.models.LatticeSnapshot import LatticeSnapshotStore
+from app.models.LatticeNeighborhood import NeighborhoodService, NeighborhoodView
+from app.controllers.logger_controller import logger
+
+# Metadata key that marks vector store entries written by the lattice (value: node type)
+LATTICE_NODE_KEY = "lattice_node_type"
 
 class LatticeNode(BaseModel):
     id: str
@@ -11,188 +26,488 @@ class LatticeNode(BaseModel):
     source: str
     timestamp: datetime
     node_type: str  # e.g.
-    connections: Set[str] = set() 
+    connections: Set[str] = set()
     embedding: Optional[List[float]] = None
-    
+
 class LatticeEdge(BaseModel):
     source_id: str
     target_id: str
-    relation_type: str 
+    relation_type: str
     weight: float = 1.0
     metadata: Dict[str, Any] = {}
 
+class _NodeIndexView(Mapping):
+    """Vista de solo lectura id -> LatticeNode, materializada bajo demanda"""
+
+    def __init__(self, lattice: "LatticeMemory"):
+        self._lattice = lattice
+
+    def __getitem__(self, node_id: str) -> LatticeNode:
+        if node_id not in self._lattice.graph:
+            raise KeyError(node_id)
+        return self._lattice.get_node(node_id)
+
+    def __contains__(self, node_id) -> bool:
+        return node_id in self._lattice.graph
+
+    def __iter__(self):
+        return iter(self._lattice.graph.index_of)
+
+    def __len__(self) -> int:
+        return len(self._lattice.graph)
+
 class LatticeMemory:
+    # Límites por defecto de find_paths: evitan enumeraciones exponenciales
+    max_paths = 100
+    path_timeout = 2.0
+
     def __init__(self, memory_manager):
         self.memory_manager = memory_manager
-        self.graph = nx.MultiDiGraph()  # Allows multiple edges between nodes
-        self.node_index = {}  # Quick lookup for nodes
-        self.relation_types = set()  # Track all relation types
-        
+        self.node_index = _NodeIndexView(self)  # Quick lookup for nodes
+        self.auto_link = os.getenv("LATTICE_AUTO_LINK", "true").lower() == "true"
+
+        # Snapshot + change log: restart reloads the lattice instead of re-embedding
+        snapshot_dir = os.getenv("LATTICE_SNAPSHOT_DIR")
+        self.snapshot_store = LatticeSnapshotStore(snapshot_dir) if snapshot_dir else None
+        graph = None
+        if self.snapshot_store is not None:
+            try:
+                graph = self.snapshot_store.load()
+            except Exception as e:
+                logger.error(f"Failed to load lattice snapshot: {str(e)}")
+        self._attach_graph(graph or LatticeGraph())
+
+    def _attach_graph(self, graph: LatticeGraph):
+        """Set the array-backed multigraph and the services built on it"""
+        self.graph = graph
+        self.centrality = CentralityService(self.graph)  # Cached by graph version
+        self.paths = PathQueryEngine(self.graph)  # Bounded path queries
+        self.communities = CommunityService(self.graph)  # Incremental Louvain
+        self.neighborhoods = NeighborhoodService(self.graph)  # LRU k-hop views
+        self.auto_linker = AutoLinker(
+            self.graph,
+            threshold=float(os.getenv("LATTICE_LINK_THRESHOLD", "0.85")),
+            max_links=int(os.getenv("LATTICE_MAX_LINKS", "5"))
+        )
+        if self.snapshot_store is not None:
+            self.snapshot_store.attach(self.graph)
+
+    def snapshot(self) -> Optional[int]:
+        """Write a snapshot of the lattice and start a new change log"""
+        if self.snapshot_store is None:
+            return None
+        try:
+            return self.snapshot_store.save(self.graph)
+        except Exception as e:
+            logger.error(f"Failed to save lattice snapshot: {str(e)}")
+            return None
+
+    def restore(self, directory: str) -> bool:
+        """Replace the lattice with the snapshot (and change log) stored in directory"""
+        store = LatticeSnapshotStore(directory)
+        graph = store.load()
+        if graph is None:
+            return False
+        if self.graph.journal is not None:
+            self.graph.journal.close()
+        self.snapshot_store = store
+        self._attach_graph(graph)
+        return True
+
+    @property
+    def relation_types(self) -> Set[str]:
+        """Track all relation types"""
+        return set(self.graph.relation_names)
+
+    def get_node(self, node_id: str, include_embedding: bool = True) -> LatticeNode:
+        """Materializa un LatticeNode a partir del registro compacto"""
+        index = self.graph.node_index(node_id)
+        record = self.graph.records[index]
+        embedding = self.graph.get_embedding(index) if include_embedding else None
+        return LatticeNode(
+            id=record.id,
+            text=record.text,
+            metadata=record.metadata,
+            source=record.source,
+            timestamp=record.timestamp,
+            node_type=record.node_type,
+            connections={self.graph.node_ids[i] for i in self.graph.neighbors(index)},
+            embedding=embedding.tolist() if embedding is not None else None
+        )
+
     async def add_node(self, entry: MemoryEntry, node_type: str = "concept") -> str:
         """Add a new node to the lattice"""
-        node_id = str(hash(f"{entry.text}{entry.timestamp}"))
-        
-        # Create embedding using existing memory manager
-        cached_embedding = self.memory_manager.embedding_cache.get(
-            entry.text, 
-            "multilingual-e5-large"
-        )
-        
-        if not cached_embedding:
-            embedding = self.memory_manager.pc.inference.embed(
-                model="multilingual-e5-large",
-                inputs=[entry.text],
-                parameters={"input_type": "passage", "truncate": "END"}
-            )
-            cached_embedding = embedding[0].values
-            self.memory_manager.embedding_cache.set(
-                entry.text,
-                "multilingual-e5-large",
-                cached_embedding
-            )
-        
-        node = LatticeNode(
-            id=node_id,
-            text=entry.text,
-            metadata=entry.metadata,
-            source=entry.source,
-            timestamp=entry.timestamp or datetime.now(),
-            node_type=node_type,
+        node_id = memory_id(entry.text, entry.source)
+        if node_id in self.graph:
+            # Mismo contenido y fuente: el nodo ya existe
+            return node_id
+
+        # Create embedding using existing memory manager (cached + batched)
+        cached_embedding = await self.memory_manager.embed_text(entry.text, input_type="passage")
+
+        index = self.graph.add_node(
+            NodeRecord(
+                id=node_id,
+                text=entry.text,
+                metadata=entry.metadata,
+                source=entry.source,
+                timestamp=entry.timestamp or datetime.now(),
+                node_type=node_type
+            ),
             embedding=cached_embedding
         )
-        
-        self.graph.add_node(node_id, **node.dict())
-        self.node_index[node_id] = node
-        
+
+        # Link to the most similar existing nodes (similar_to edges)
+        if self.auto_link:
+            self.auto_linker.link_node(index)
+
         # Add to vector store for similarity search
-        await self.memory_manager.add_to_memory(entry)
-        
+        await self.memory_manager.add_to_memory(self._stored_entry(entry, node_type))
+
         return node_id
-        
+
     def add_edge(self, edge: LatticeEdge):
         """Add a new edge between nodes"""
         if edge.source_id not in self.graph or edge.target_id not in self.graph:
             raise ValueError("Both source and target nodes must exist")
-            
+
         self.graph.add_edge(
-            edge.source_id,
-            edge.target_id,
+            self.graph.index_of[edge.source_id],
+            self.graph.index_of[edge.target_id],
             relation_type=edge.relation_type,
             weight=edge.weight,
             metadata=edge.metadata
         )
-        
-        # Update connections in nodes
-        source_node = self.node_index[edge.source_id]
-        target_node = self.node_index[edge.target_id]
-        source_node.connections.add(edge.target_id)
-        target_node.connections.add(edge.source_id)
-        
-        self.relation_types.add(edge.relation_type)
-        
+
+    def batch(self):
+        """Group mutations so caches (centrality, communities, paths) are invalidated once"""
+        return self.graph.batch()
+
+    async def add_nodes(self, entries: List[MemoryEntry], node_type: str = "concept") -> List[str]:
+        """Add several nodes with a single embedding batch and one graph invalidation"""
+        node_ids, new_entries, embeddings = await self._embed_new_entries(entries)
+        with self.graph.batch():
+            self._insert_nodes(new_entries, embeddings, node_type)
+        await self._store_entries(new_entries, node_type)
+        return node_ids
+
+    async def _embed_new_entries(self, entries: List[MemoryEntry]):
+        """Ids for every entry, plus the entries not yet in the lattice and their embeddings"""
+        node_ids = [memory_id(entry.text, entry.source) for entry in entries]
+        new_entries = {}
+        for node_id, entry in zip(node_ids, entries):
+            if node_id not in self.graph and node_id not in new_entries:
+                new_entries[node_id] = entry
+        embeddings = []
+        if new_entries:
+            embeddings = await self.memory_manager.embed_texts(
+                [entry.text for entry in new_entries.values()], input_type="passage"
+            )
+        return node_ids, new_entries, embeddings
+
+    def _insert_nodes(self, new_entries: Dict[str, MemoryEntry], embeddings: List, node_type: str):
+        # Each id is paired with its embedding before skipping the ones another
+        # call inserted while awaiting embed_texts, so the two lists stay aligned
+        indices, embedded = [], []
+        for (node_id, entry), values in zip(new_entries.items(), embeddings):
+            if node_id in self.graph:
+                continue
+            index = self.graph.add_node(NodeRecord(
+                id=node_id,
+                text=entry.text,
+                metadata=entry.metadata,
+                source=entry.source,
+                timestamp=entry.timestamp or datetime.now(),
+                node_type=node_type
+            ))
+            indices.append(index)
+            if values:
+                embedded.append((index, values))
+        if embedded:
+            self.graph.set_embeddings(
+                np.array([index for index, _ in embedded]),
+                np.array([values for _, values in embedded], dtype=np.float32)
+            )
+        if self.auto_link:
+            for index in indices:
+                self.auto_linker.link_node(index)
+
+    @staticmethod
+    def _stored_entry(entry: MemoryEntry, node_type: str) -> MemoryEntry:
+        """Copy of the entry whose metadata marks it as a lattice node"""
+        return MemoryEntry(
+            text=entry.text,
+            metadata={**entry.metadata, LATTICE_NODE_KEY: node_type},
+            source=entry.source,
+            timestamp=entry.timestamp
+        )
+
+    async def _store_entries(self, new_entries: Dict[str, MemoryEntry], node_type: str):
+        """Add entries to the vector store; the write-behind buffer groups the upserts"""
+        acks = [
+            await self.memory_manager.submit_to_memory(self._stored_entry(entry, node_type))
+            for entry in new_entries.values()
+        ]
+        await asyncio.gather(*acks)
+
+    def add_edges(self, edges: List[LatticeEdge]):
+        """Add several edges; all endpoints are validated before anything is written"""
+        missing = {
+            node_id
+            for edge in edges
+            for node_id in (edge.source_id, edge.target_id)
+            if node_id not in self.graph
+        }
+        if missing:
+            raise ValueError(f"Both source and target nodes must exist (missing: {sorted(missing)})")
+        if not edges:
+            return
+
+        self.graph.add_edges(
+            np.array([self.graph.index_of[edge.source_id] for edge in edges]),
+            np.array([self.graph.index_of[edge.target_id] for edge in edges]),
+            [edge.relation_type for edge in edges],
+            np.array([edge.weight for edge in edges], dtype=np.float32),
+            [edge.metadata for edge in edges]
+        )
+
     async def find_similar_nodes(self, query: str, top_k: int = 5) -> List[LatticeNode]:
-        """Find similar nodes using vector similarity"""
-        query_request = QueryRequest(query=query, top_k=top_k)
+        """
+        Find similar nodes using vector similarity. Lattice entries missing from
+        the graph are restored into it; other memories (chat, summaries) are
+        returned as detached nodes and leave the graph untouched.
+        """
+        query_request = QueryRequest(query=query, top_k=top_k, include_values=True)
         matches = await self.memory_manager.query_memory(query_request)
-        
+
         similar_nodes = []
         for match in matches:
-            node_id = str(hash(f"{match.metadata['text']}{match.metadata['timestamp']}"))
-            if node_id in self.node_index:
-                similar_nodes.append(self.node_index[node_id])
-                
+            node_id = match.id
+            if node_id not in self.graph and match.metadata:
+                node_id = memory_id(match.metadata.get('text', ''), match.metadata.get('source', ''))
+            if node_id in self.graph:
+                similar_nodes.append(self.get_node(node_id))
+                continue
+            record = self._record_from_match(node_id, match)
+            if record is None:
+                continue
+            embedding = getattr(match, "values", None) or None
+            if (match.metadata or {}).get(LATTICE_NODE_KEY):
+                self.graph.add_node(record, embedding=embedding)
+                similar_nodes.append(self.get_node(node_id))
+            else:
+                similar_nodes.append(LatticeNode(
+                    id=record.id,
+                    text=record.text,
+                    metadata=record.metadata,
+                    source=record.source,
+                    timestamp=record.timestamp,
+                    node_type=record.node_type,
+                    embedding=list(embedding) if embedding is not None else None
+                ))
+
         return similar_nodes
-        
+
+    @staticmethod
+    def _record_from_match(node_id: str, match) -> Optional[NodeRecord]:
+        """Node record rebuilt from the metadata stored with a vector"""
+        metadata = dict(getattr(match, "metadata", None) or {})
+        text = metadata.pop("text", None)
+        source = metadata.pop("source", None)
+        if text is None or source is None:
+            logger.debug(f"Dropping match {match.id}: no lattice node and no stored text")
+            return None
+        node_type = metadata.pop(LATTICE_NODE_KEY, None) or "memory"
+        timestamp = metadata.pop("timestamp", None)
+        try:
+            timestamp = datetime.fromisoformat(timestamp) if timestamp else datetime.now()
+        except ValueError:
+            timestamp = datetime.now()
+
+        return NodeRecord(
+            id=node_id,
+            text=text,
+            metadata=metadata,
+            source=source,
+            timestamp=timestamp,
+            node_type=node_type
+        )
+
     def get_node_neighborhood(self, node_id: str, depth: int = 1) -> nx.MultiDiGraph:
         """Get subgraph of nodes connected to given node up to specified depth"""
+        return self.get_neighborhood_view(node_id, depth).to_networkx()
+
+    def get_neighborhood_view(self, node_id: str, depth: int = 1) -> NeighborhoodView:
+        """Lightweight (cached) k-hop view: node and edge ids, attributes read lazily"""
+        return self.neighborhoods.get(self.graph.node_index(node_id), depth)
+
+    def get_neighborhood_context(self, node_id: str, depth: int = 1, max_nodes: int = 10) -> List[str]:
+        """Texts around a node for prompt building, strongest connections first"""
         if node_id not in self.graph:
-            raise ValueError("Node not found")
-            
-        neighborhood = nx.ego_graph(self.graph, node_id, radius=depth)
-        return neighborhood
-        
-    def find_paths(self, source_id: str, target_id: str, cutoff: Optional[int] = None) -> List[List[str]]:
-        """Find all paths between two nodes, optionally limited by length"""
-        try:
-            paths = list(nx.all_simple_paths(
-                self.graph,
-                source=source_id,
-                target=target_id,
-                cutoff=cutoff
-            ))
-            return paths
-        except nx.NetworkXNoPath:
             return []
-            
-    def get_node_centrality(self, node_id: str) -> float:
-        """Calculate centrality score for a node"""
+        return self.get_neighborhood_view(node_id, depth).texts(limit=max_nodes)
+
+    def find_paths(self,
+                   source_id: str,
+                   target_id: str,
+                   cutoff: Optional[int] = None,
+                   max_paths: Optional[int] = None,
+                   timeout: Optional[float] = None) -> List[List[str]]:
+        """Find simple paths between two nodes, bounded by length, count and time"""
+        if source_id not in self.graph or target_id not in self.graph:
+            return []
+        paths = self.paths.iter_paths(
+            self.graph.index_of[source_id],
+            self.graph.index_of[target_id],
+            max_depth=cutoff,
+            max_paths=max_paths if max_paths is not None else self.max_paths,
+            timeout=timeout if timeout is not None else self.path_timeout
+        )
+        return [[self.graph.node_ids[i] for i in path] for path in paths]
+
+    async def iter_paths(self,
+                         source_id: str,
+                         target_id: str,
+                         cutoff: Optional[int] = None,
+                         max_paths: Optional[int] = None,
+                         timeout: Optional[float] = None) -> AsyncIterator[List[str]]:
+        """Stream simple paths between two nodes without blocking the event loop"""
+        if source_id not in self.graph or target_id not in self.graph:
+            return
+        paths = self.paths.aiter_paths(
+            self.graph.index_of[source_id],
+            self.graph.index_of[target_id],
+            max_depth=cutoff,
+            max_paths=max_paths if max_paths is not None else self.max_paths,
+            timeout=timeout if timeout is not None else self.path_timeout
+        )
+        async for path in paths:
+            yield [self.graph.node_ids[i] for i in path]
+
+    def find_shortest_paths(self, source_id: str, target_id: str, k: int = 3) -> List[Tuple[List[str], float]]:
+        """k shortest paths (Yen), where stronger edges are shorter (cost = 1 / weight)"""
+        if source_id not in self.graph or target_id not in self.graph:
+            return []
+        paths = self.paths.k_shortest_paths(
+            self.graph.index_of[source_id],
+            self.graph.index_of[target_id],
+            k
+        )
+        return [([self.graph.node_ids[i] for i in path], cost) for path, cost in paths]
+
+    def is_reachable(self, source_id: str, target_id: str, max_depth: Optional[int] = None) -> bool:
+        """Check whether target can be reached from source following edge direction"""
+        if source_id not in self.graph or target_id not in self.graph:
+            return False
+        return self.paths.reachable(
+            self.graph.index_of[source_id],
+            self.graph.index_of[target_id],
+            max_depth
+        )
+
+    def get_node_centrality(self, node_id: str, method: str = "eigenvector") -> float:
+        """Calculate centrality score for a node (eigenvector, pagerank or degree)"""
         if node_id not in self.graph:
             raise ValueError("Node not found")
-            
-        centrality = nx.eigenvector_centrality_numpy(self.graph)
-        return centrality[node_id]
-        
+
+        return self.centrality.score(node_id, method)
+
+    def get_centrality_scores(self, method: str = "eigenvector") -> Dict[str, float]:
+        """Centrality scores for every node, computed once per graph version"""
+        return self.centrality.as_dict(method)
+
     def get_community_structure(self) -> Dict[str, List[str]]:
         """Detect communities in the lattice"""
-        communities = nx.community.louvain_communities(self.graph.to_undirected())
-        
-        community_dict = {}
-        for i, community in enumerate(communities):
-            community_dict[f"community_{i}"] = list(community)
-            
-        return community_dict
-        
-    def prune_weak_connections(self, weight_threshold: float = 0.3):
-        """Remove edges with weight below threshold"""
-        edges_to_remove = [
-            (u, v, k) for u, v, k, d in self.graph.edges(data=True, keys=True)
-            if d['weight'] < weight_threshold
-        ]
-        
-        for u, v, k in edges_to_remove:
-            self.graph.remove_edge(u, v, k)
-            
-    def merge_nodes(self, node_ids: List[str], merged_text: str):
+        return {
+            f"community_{label}": members
+            for label, members in self.communities.communities().items()
+        }
+
+    def get_node_community(self, node_id: str) -> str:
+        """Community of a single node (O(1) once the partition is up to date)"""
+        if node_id not in self.graph:
+            raise ValueError("Node not found")
+        return f"community_{self.communities.community_of(node_id)}"
+
+    def get_community_summary(self) -> nx.Graph:
+        """Community-level graph with sizes, internal weight and cross-community weights"""
+        return self.communities.summary_graph()
+
+    def relink_similar_nodes(self) -> int:
+        """Rebuild similar_to edges for the whole lattice in memory-bounded blocks"""
+        return self.auto_linker.link_all()
+
+    def prune_weak_connections(self, weight_threshold: float = 0.3) -> int:
+        """Remove edges with weight below threshold (one vectorized pass)"""
+        return self.graph.prune(weight_threshold)
+
+    async def merge_nodes(self, node_ids: List[str], merged_text: str) -> str:
         """Merge multiple nodes into a single node"""
-        if not all(node_id in self.graph for node_id in node_ids):
+        merged_ids = await self.merge_node_groups([(node_ids, merged_text)])
+        return merged_ids[0]
+
+    async def merge_node_groups(self, groups: List[Tuple[List[str], str]]) -> List[str]:
+        """
+        Merge several disjoint groups of nodes in one pass: one embedding batch
+        for the merged texts, bulk edge transfer and bulk removal.
+        """
+        all_ids = [node_id for node_ids, _ in groups for node_id in node_ids]
+        if not all(node_id in self.graph for node_id in all_ids):
             raise ValueError("All nodes must exist in the graph")
-            
-        # Create new merged node
-        merged_metadata = {}
-        merged_connections = set()
-        sources = set()
-        timestamps = []
-        
-        for node_id in node_ids:
-            node = self.node_index[node_id]
-            merged_metadata.update(node.metadata)
-            merged_connections.update(node.connections)
-            sources.add(node.source)
-            timestamps.append(node.timestamp)
-            
-        merged_entry = MemoryEntry(
-            text=merged_text,
-            metadata=merged_metadata,
-            source=", ".join(sources),
-            timestamp=max(timestamps)
-        )
-        
-        # Add merged node
-        merged_id = self.add_node(merged_entry)
-        
-        # Transfer connections
-        for conn in merged_connections:
-            if conn not in node_ids:  # Don't connect to nodes being merged
-                self.add_edge(LatticeEdge(
-                    source_id=merged_id,
-                    target_id=conn,
-                    relation_type="merged_connection",
-                    weight=1.0
-                ))
-                
-        # Remove original nodes
-        for node_id in node_ids:
-            self.graph.remove_node(node_id)
-            del self.node_index[node_id]
-            
-        return merged_id
\ No newline at end of file
+        if len(set(all_ids)) != len(all_ids):
+            raise ValueError("Merge groups must be disjoint")
+
+        # Create new merged nodes
+        merged_entries = []
+        group_connections = []
+        for node_ids, merged_text in groups:
+            merged_metadata = {}
+            merged_connections = set()
+            sources = set()
+            timestamps = []
+            for node_id in node_ids:
+                index = self.graph.index_of[node_id]
+                record = self.graph.records[index]
+                merged_metadata.update(record.metadata)
+                merged_connections.update(self.graph.node_ids[i] for i in self.graph.neighbors(index))
+                sources.add(record.source)
+                timestamps.append(record.timestamp)
+
+            merged_entries.append(MemoryEntry(
+                text=merged_text,
+                metadata=merged_metadata,
+                source=", ".join(sorted(sources)),
+                timestamp=max(timestamps)
+            ))
+            group_connections.append(merged_connections)
+
+        merged_ids, new_entries, embeddings = await self._embed_new_entries(merged_entries)
+        merged_set = set(merged_ids)
+        with self.graph.batch():
+            self._insert_nodes(new_entries, embeddings, "concept")
+
+            # Connections to a node of another group point to that group's merged node
+            replacement = {
+                node_id: merged_id
+                for (node_ids, _), merged_id in zip(groups, merged_ids)
+                for node_id in node_ids
+            }
+            transferred = []
+            for merged_id, connections in zip(merged_ids, group_connections):
+                targets = {replacement.get(conn, conn) for conn in connections} - {merged_id}
+                transferred.extend(
+                    LatticeEdge(
+                        source_id=merged_id,
+                        target_id=target,
+                        relation_type="merged_connection",
+                        weight=1.0
+                    )
+                    for target in sorted(targets)
+                )
+
+            # Remove original nodes (a merged node can reuse an original id)
+            self.graph.remove_nodes([node_id for node_id in all_ids if node_id not in merged_set])
+            self.add_edges(transferred)
+
+        await self._store_entries(new_entries, "concept")
+        return merged_ids
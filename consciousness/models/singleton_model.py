@@ -1,7 +1,11 @@
-from typing import Optional, Dict, Literal
-from datetime import datetime
-import weakref
+from typing import Any, AsyncIterator, Optional, Dict, Literal, Set
+from datetime import datetime, timedelta
 from enum import Enum
+import asyncio
+import os
+import sys
+import time
+import httpx
 from langchain_openai import ChatOpenAI
 from langchain_anthropic import ChatAnthropic
 from langchain_groq import ChatGroq
@@ -12,18 +16,117 @@ class LLMProvider(Enum):
     ANTHROPIC = "anthropic"
     GROQ = "groq"
 
+# Límites por defecto (concurrencia, requests por minuto); se sobrescriben con
+# LLM_<PROVIDER>_MAX_CONCURRENCY y LLM_<PROVIDER>_RPM
+_DEFAULT_LIMITS = {
+    LLMProvider.OPENAI: (8, 500),
+    LLMProvider.ANTHROPIC: (4, 50),
+    LLMProvider.GROQ: (8, 30),
+}
+
+class TokenBucket:
+    """Rate limit por token bucket: `rate` tokens por segundo, ráfagas de hasta `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0):
+        while True:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return
+            await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+class ProviderLimiter:
+    """Semáforo de concurrencia + token bucket de un proveedor (`async with limiter:`)"""
+
+    def __init__(self, provider: LLMProvider):
+        default_concurrency, default_rpm = _DEFAULT_LIMITS[provider]
+        prefix = f"LLM_{provider.name}"
+        self.max_concurrency = int(os.getenv(f"{prefix}_MAX_CONCURRENCY", default_concurrency))
+        self.requests_per_minute = float(os.getenv(f"{prefix}_RPM", default_rpm))
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._bucket = TokenBucket(
+            rate=self.requests_per_minute / 60.0,
+            capacity=max(1.0, min(self.max_concurrency, self.requests_per_minute / 60.0 * 10))
+        )
+        self.in_flight = 0
+        self.total_requests = 0
+        self.total_wait = 0.0
+
+    async def __aenter__(self):
+        started = time.monotonic()
+        await self._bucket.acquire()
+        await self._semaphore.acquire()
+        self.total_wait += time.monotonic() - started
+        self.in_flight += 1
+        self.total_requests += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.in_flight -= 1
+        self._semaphore.release()
+        return False
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "in_flight": self.in_flight,
+            "total_requests": self.total_requests,
+            "avg_wait": self.total_wait / self.total_requests if self.total_requests else 0.0,
+        }
+
+# Referencias a una instancia durante evict_idle: el dict de instancias, la
+# variable local y el argumento de sys.getrefcount. Más = alguien la conserva
+_MANAGER_REFERENCES = 3
+
 class MultiProviderLLMManager:
     _system_prompt = """
         """
-    # Diccionario de instancias por proveedor
-    _instances: Dict[LLMProvider, Dict[str, 'weakref.ref']] = {
+    # Instancias por proveedor (referencias fuertes; se desalojan por inactividad)
+    _instances: Dict[LLMProvider, Dict[str, 'MultiProviderLLMManager']] = {
         provider: {} for provider in LLMProvider
     }
-    
+
     _last_used: Dict[LLMProvider, Dict[str, datetime]] = {
         provider: {} for provider in LLMProvider
     }
-    
+
+    idle_ttl = timedelta(seconds=int(os.getenv("LLM_INSTANCE_IDLE_TTL", 3600)))
+
+    # Pool HTTP compartido (keep-alive) para los clientes compatibles
+    _http_client: Optional[httpx.AsyncClient] = None
+    _limiters: Dict[LLMProvider, ProviderLimiter] = {}
+    _closing: Set[asyncio.Task] = set()
+
+    @classmethod
+    def get_http_client(cls) -> httpx.AsyncClient:
+        if cls._http_client is None or cls._http_client.is_closed:
+            cls._http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", 100)),
+                    max_keepalive_connections=int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", 20)),
+                    keepalive_expiry=60.0
+                ),
+                timeout=httpx.Timeout(60.0, connect=10.0)
+            )
+        return cls._http_client
+
+    @classmethod
+    def get_limiter(cls, provider: LLMProvider) -> ProviderLimiter:
+        limiter = cls._limiters.get(provider)
+        if limiter is None:
+            limiter = cls._limiters[provider] = ProviderLimiter(provider)
+        return limiter
+
     @classmethod
     def create_llm(cls, provider: LLMProvider, api_key: str, **kwargs) -> any:
         """
@@ -34,25 +137,29 @@ class MultiProviderLLMManager:
                 api_key=api_key,
                 model=kwargs.get('model', 'gpt-4o-mini'),
                 temperature=kwargs.get('temperature', 0),
-                streaming=True
+                streaming=True,
+                http_async_client=cls.get_http_client()
             )
-            
+
         elif provider == LLMProvider.ANTHROPIC:
+            # El SDK de Anthropic mantiene su propio pool; al conservar la
+            # instancia se reutilizan sus conexiones
             return ChatAnthropic(
                 api_key=api_key,
                 model=kwargs.get('model', 'claude-3-opus-20240229'),
                 temperature=kwargs.get('temperature', 0),
                 streaming=True
             )
-            
+
         elif provider == LLMProvider.GROQ:
             return ChatGroq(
                 api_key=api_key,
                 model=kwargs.get('model', 'mixtral-8x7b-32768'),
                 temperature=kwargs.get('temperature', 0),
-                streaming=True
+                streaming=True,
+                http_async_client=cls.get_http_client()
             )
-            
+
         raise ValueError(f"Proveedor no soportado: {provider}")
 
     def __init__(self, provider: LLMProvider, api_key: str, **kwargs):
@@ -61,36 +168,70 @@ class MultiProviderLLMManager:
         """
         self._llm = self.create_llm(provider, api_key, **kwargs)
         self.provider = provider
-    
+        self.limiter = self.get_limiter(provider)
+
     @classmethod
-    def get_instance(cls, 
+    def get_instance(cls,
                     provider: LLMProvider,
-                    instance_name: str, 
+                    instance_name: str,
                     api_key: Optional[str] = None,
                     **kwargs) -> 'MultiProviderLLMManager':
         """
         Get or create an LLM instance for a specific provider
         """
+        cls.evict_idle()
         provider_instances = cls._instances[provider]
-        
-        # Verificar si la instancia existe y está activa
-        if instance_name in provider_instances:
-            instance = provider_instances[instance_name]()
-            if instance is not None:
-                cls._last_used[provider][instance_name] = datetime.now()
-                return instance
-        
-        # Crear nueva instancia si no existe o está inactiva
+
+        # Verificar si la instancia existe
+        instance = provider_instances.get(instance_name)
+        if instance is not None:
+            cls._last_used[provider][instance_name] = datetime.now()
+            return instance
+
+        # Crear nueva instancia si no existe o fue desalojada
         if api_key is None:
             raise ValueError(f"API key is required to create new instance '{instance_name}' for {provider.value}")
-        
+
         new_instance = cls(provider, api_key, **kwargs)
-        provider_instances[instance_name] = weakref.ref(new_instance)
+        provider_instances[instance_name] = new_instance
         cls._last_used[provider][instance_name] = datetime.now()
-        
+
         logger.info(f"Created new {provider.value} LLM instance: {instance_name}")
         return new_instance
-    
+
+    @classmethod
+    def evict_idle(cls, now: Optional[datetime] = None) -> int:
+        """
+        Desaloja y cierra las instancias sin uso durante más de idle_ttl. Las que
+        algún controlador conserva no se desalojan: seguirían vivas y el siguiente
+        get_instance crearía un segundo cliente.
+        """
+        now = now or datetime.now()
+        evicted = 0
+        for provider in LLMProvider:
+            for instance_name, last_used in list(cls._last_used[provider].items()):
+                if now - last_used <= cls.idle_ttl:
+                    continue
+                instance = cls._instances[provider].get(instance_name)
+                if instance is not None and sys.getrefcount(instance) > _MANAGER_REFERENCES:
+                    continue
+                cls.remove_instance(provider, instance_name)
+                if instance is not None:
+                    cls._close_later(instance)
+                evicted += 1
+        return evicted
+
+    @classmethod
+    def _close_later(cls, instance: 'MultiProviderLLMManager'):
+        """Programa el cierre de una instancia desalojada (si hay event loop)"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = loop.create_task(instance.close())
+        cls._closing.add(task)
+        task.add_done_callback(cls._closing.discard)
+
     @classmethod
     def remove_instance(cls, provider: LLMProvider, instance_name: str) -> None:
         """
@@ -100,11 +241,49 @@ class MultiProviderLLMManager:
             del cls._instances[provider][instance_name]
             cls._last_used[provider].pop(instance_name, None)
             logger.info(f"Removed {provider.value} LLM instance: {instance_name}")
-    
+
+    @classmethod
+    async def aclose(cls):
+        """Cierra el pool HTTP compartido (usar en shutdown)"""
+        if cls._http_client is not None and not cls._http_client.is_closed:
+            await cls._http_client.aclose()
+        cls._http_client = None
+
     @property
     def llm(self):
         return self._llm
-    
+
+    async def close(self):
+        """Cierra el cliente propio del modelo; el pool HTTP compartido sigue abierto"""
+        if self.provider != LLMProvider.ANTHROPIC:
+            return
+        # Solo si llegó a crearse (cached_property del SDK)
+        client = vars(self._llm).get("_async_client")
+        if client is not None:
+            try:
+                await client.close()
+            except Exception as e:
+                logger.warning(f"Failed to close {self.provider.value} client: {str(e)}")
+
+    def touch(self):
+        instance_names = self._last_used[self.provider]
+        for instance_name, instance in self._instances[self.provider].items():
+            if instance is self:
+                instance_names[instance_name] = datetime.now()
+
+    async def ainvoke(self, input: Any, **kwargs) -> Any:
+        """ainvoke del modelo respetando la concurrencia y el rate limit del proveedor"""
+        self.touch()
+        async with self.limiter:
+            return await self._llm.ainvoke(input, **kwargs)
+
+    async def astream(self, input: Any, **kwargs) -> AsyncIterator[Any]:
+        """astream del modelo; el cupo del proveedor se mantiene durante todo el stream"""
+        self.touch()
+        async with self.limiter:
+            async for chunk in self._llm.astream(input, **kwargs):
+                yield chunk
+
     @classmethod
     def get_active_instances(cls) -> Dict[str, list]:
         """
@@ -114,4 +293,7 @@ class MultiProviderLLMManager:
         for provider in LLMProvider:
             active_instances[provider.value] = list(cls._instances[provider].keys())
         return active_instances
-    
\ No newline at end of file
+
+    @classmethod
+    def get_limiter_stats(cls) -> Dict[str, Dict[str, float]]:
+        return {provider.value: limiter.stats() for provider, limiter in cls._limiters.items()}
@@ -1,7 +1,8 @@
- fastapi import FastAPI
+from fastapi import FastAPI
 from pinecone import Pinecone
 from typing import List, Dict
 import re
+from app.models.EmbeddingCoalescer import PineconeEmbeddingProvider
 
 app = FastAPI()
 pc = Pinecone(api_key="YOUR_API_KEY")
@@ -11,6 +12,7 @@ class DocumentIndexer:
         self.index_name = "docs"
         self._initialize_index()
         self.index = pc.Index(self.index_name)
+        self.embedding_provider = PineconeEmbeddingProvider(pc)
 
     def _initialize_index(self):
         if not pc.has_index(self.index_name):
@@ -51,24 +53,23 @@ class DocumentIndexer:
         """
         """
         sections = self._split_document(content)
-        vectors = []
-        
-        for i, section in enumerate(sections):
-            section_text = f"""
+        section_texts = [
+            f"""
             Documento: {doc_type}
             Sección: {section['title']}
             Contenido: {' '.join(section['content'])}
             """
-            
-            embedding = pc.inference.embed(
-                model="multilingual-e5-large",
-                inputs=[section_text],
-                parameters={"input_type": "passage"}
-            )
-            
+            for section in sections
+        ]
+        
+        # Un solo request de embeddings para todas las secciones
+        embeddings = self.embedding_provider.embed(section_texts, input_type="passage")
+        
+        vectors = []
+        for i, (section, values) in enumerate(zip(sections, embeddings)):
             vector = {
                 "id": f"{doc_type}-section-{i}",
-                "values": embedding[0].values,
+                "values": values,
                 "metadata": {
                     "doc_type": doc_type,
                     "section_title": section['title'],
@@ -0,0 +1,112 @@
+from typing import Any, Awaitable, Dict, Optional, Set
+import asyncio
+import os
+from app.controllers.logger_controller import logger
+
+
+class TaskSupervisor:
+    """
+    Tareas en segundo plano (fire-and-forget) con referencia fuerte, límite de
+    tareas en vuelo y contadores de fallos. `submit` espera a que haya un hueco
+    libre (backpressure) en lugar de acumular tareas sin control; `drain`
+    espera a las pendientes en el shutdown.
+    """
+    _instance = None
+
+    def __init__(self, max_in_flight: int = 64, drain_timeout: float = 30.0):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        self.max_in_flight = max_in_flight
+        self.drain_timeout = drain_timeout
+        self._tasks: Set[asyncio.Task] = set()
+        # El semáforo se crea dentro del event loop (Python 3.9 lo asocia al crearlo)
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls(
+                max_in_flight=int(os.getenv("TASK_SUPERVISOR_MAX_IN_FLIGHT", 64)),
+                drain_timeout=float(os.getenv("TASK_SUPERVISOR_DRAIN_TIMEOUT", 30))
+            )
+        return cls._instance
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+        return self._slots
+
+    async def submit(self, coro: Awaitable[Any], name: Optional[str] = None) -> asyncio.Task:
+        """Lanza `coro` en segundo plano; espera si ya hay max_in_flight tareas en vuelo"""
+        slots = self._semaphore()
+        self.waiting += 1
+        try:
+            await slots.acquire()
+        except BaseException:
+            # La corrutina no llegará a ejecutarse: se cierra para evitar el warning
+            if asyncio.iscoroutine(coro):
+                coro.close()
+            raise
+        finally:
+            self.waiting -= 1
+
+        task = asyncio.ensure_future(coro)
+        if name and hasattr(task, "set_name"):
+            task.set_name(name)
+        self._tasks.add(task)
+        self.submitted += 1
+        task.add_done_callback(self._on_done)
+        return task
+
+    def _on_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        self._slots.release()
+        if task.cancelled():
+            self.cancelled += 1
+            return
+        error = task.exception()
+        if error is not None:
+            self.failed += 1
+            logger.error(f"Background task {task.get_name()} failed: {str(error)}")
+        else:
+            self.completed += 1
+
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        """Espera a las tareas pendientes; las que superan el plazo se cancelan"""
+        timeout = self.drain_timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        # Las tareas pueden encolar otras mientras terminan
+        while self._tasks:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            await asyncio.wait(set(self._tasks), timeout=remaining)
+
+        if not self._tasks:
+            return True
+        pending = set(self._tasks)
+        logger.warning(f"Cancelling {len(pending)} background tasks still running after {timeout}s")
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        return False
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+        }
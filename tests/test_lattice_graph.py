@@ -0,0 +1,57 @@
+"""
+Regresiones de LatticeGraph / AutoLinker.
+
+    PYTHONPATH=<raíz que resuelve `app`> python -m pytest tests
+"""
+from datetime import datetime
+import numpy as np
+from app.models.LatticeAutoLinker import AutoLinker
+from app.models.LatticeGraph import LatticeGraph, NodeRecord
+
+
+def _record(node_id: str) -> NodeRecord:
+    return NodeRecord(id=node_id, text=node_id, metadata={}, source="test",
+                      timestamp=datetime.now(), node_type="concept")
+
+
+def test_node_without_embedding_past_initial_capacity():
+    # Con más nodos que la capacidad inicial, un nodo sin embedding no debe
+    # desalinear las máscaras por nodo (antes: ValueError de broadcast)
+    graph = LatticeGraph(initial_nodes=4)
+    vector = np.ones(8, dtype=np.float32)
+    for i in range(4):
+        graph.add_node(_record(f"n{i}"), vector)
+    graph.add_node(_record("plain"))
+
+    assert graph.embedded_indices().tolist() == list(range(4))
+
+    linker = AutoLinker(graph, threshold=0.5, max_links=2)
+    assert linker.link_node(graph.node_index("n3")) == 2
+    assert linker.link_all() > 0
+
+
+def test_nodes_added_after_snapshot_load_keep_the_mapped_base(tmp_path):
+    from app.models.LatticeSnapshot import LatticeSnapshotStore
+
+    graph = LatticeGraph(initial_nodes=4)
+    for i in range(3):
+        graph.add_node(_record(f"n{i}"), np.full(8, i + 1, dtype=np.float32))
+    store = LatticeSnapshotStore(str(tmp_path))
+    store.save(graph)
+
+    loaded = store.load()
+    base = loaded.embeddings
+    assert isinstance(base, np.memmap)
+    for i in range(3, 40):
+        loaded.add_node(_record(f"n{i}"), np.full(8, i + 1, dtype=np.float32))
+    # Las filas nuevas van al overflow en RAM; la base mapeada no se copia
+    assert loaded.embeddings is base
+    assert loaded.embedding_overflow.shape[0] >= 37
+    assert loaded.get_embedding(loaded.node_index("n39"))[0] == 40
+    assert AutoLinker(loaded, threshold=0.5, max_links=2).link_all() > 0
+
+    store.save(loaded)
+    reloaded = store.load()
+    rows = reloaded.embedding_rows(np.arange(40))
+    assert reloaded.embedding_overflow is None
+    assert rows[:, 0].tolist() == list(range(1, 41))